@@ -4,7 +4,7 @@ from flask import Flask, jsonify, send_from_directory
 
 
 def invalid_api_usage(e):
-    return jsonify(e.to_dict())
+    return jsonify(e.to_dict()), e.status_code
 
 
 def create_app(test_config=None):
@@ -20,6 +20,17 @@ def create_app(test_config=None):
         DATABASE=os.path.join(app.instance_path, "db.spatialite"),
         CBP_DATABASE=os.path.join(app.instance_path, "cbp.sqlite3"),
         IMPACTS_DATABASE=os.path.join(app.instance_path, "impacts.sqlite3"),
+        IMPACTS_PARQUET=os.path.join(app.instance_path, "impacts.parquet"),
+        INDEX_PAYLOADS=os.path.join(app.instance_path, "payloads"),
+        TILES_CACHE=os.path.join(app.instance_path, "tiles"),
+        CENSUS_CACHE=os.path.join(app.instance_path, "census"),
+        IMPACTS_CACHE_ENTRIES=1024,
+        IMPACTS_CACHE_BYTES=64 * 1024 * 1024,
+        MBR_FEATURE_LIMIT=5000,
+        MBR_CENTROID_LIMIT=10000,
+        DB_POOL_SIZE=8,
+        DB_MMAP_SIZE=256 * 1024 * 1024,
+        DB_CACHE_SIZE=16 * 1024 * 1024,
     )
 
     if test_config is None:
@@ -35,15 +46,30 @@ def create_app(test_config=None):
     except OSError:
         pass
 
-    app.register_error_handler(400, invalid_api_usage)
+    from .cache import ResponseCache
+
+    app.extensions["impacts_cache"] = ResponseCache(
+        max_entries=app.config["IMPACTS_CACHE_ENTRIES"],
+        max_bytes=app.config["IMPACTS_CACHE_BYTES"],
+    )
+    app.extensions["index_payloads"] = {}
 
     @app.route("/")
     def serve_index():
         return send_from_directory(app.static_folder, "index.html")
 
+    from . import db
+
+    db.init_app(app)
+
     from . import query
 
     app.register_blueprint(query.blueprint)
+    app.register_error_handler(query.InvalidAPIUsage, invalid_api_usage)
+
+    from . import tiles
+
+    app.register_blueprint(tiles.blueprint)
 
     from . import generate
 
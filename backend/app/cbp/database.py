@@ -1,8 +1,10 @@
+import json
 import pandas
 from typing import Union
 
 
 # https://api.census.gov/data/2019/cbp/variables.html
+# The tables hold only 6-digit NAICS rows, filtered when utils/cbp loads them.
 def get_industries_by_zipcode(*, db, zipcode) -> Union[pandas.DataFrame, None]:
     df = pandas.read_sql(
         "SELECT naics, est FROM zipcode where zip=:zipcode",
@@ -15,13 +17,13 @@ def get_industries_by_zipcode(*, db, zipcode) -> Union[pandas.DataFrame, None]:
 
     df = df.rename(columns={"est": "establishments"})
     df = df.astype({"establishments": "int32"})
-    df = df[df["naics"].str.contains(r"\d{6,6}")]
     return df
 
 
 def get_industries_by_county(*, db, statefp, countyfp) -> Union[pandas.DataFrame, None]:
     df = pandas.read_sql(
-        "SELECT naics, est FROM county WHERE fipstate=:statefp and fipscty=:countyfp",
+        "SELECT naics, est, emp AS EMP FROM county "
+        "WHERE fipstate=:statefp and fipscty=:countyfp",
         con=db,
         params={"statefp": statefp, "countyfp": countyfp},
     )
@@ -30,14 +32,13 @@ def get_industries_by_county(*, db, statefp, countyfp) -> Union[pandas.DataFrame
         return None
 
     df = df.rename(columns={"est": "establishments"})
-    df = df.astype({"establishments": "int32"})
-    df = df[df["naics"].str.contains(r"\d{6,6}")]
+    df = df.astype({"establishments": "int32", "EMP": "int32"})
     return df
 
 
 def get_industries_by_state(*, db, statefp) -> Union[pandas.DataFrame, None]:
     df = pandas.read_sql(
-        "SELECT naics, est FROM state WHERE fipstate=:statefp",
+        "SELECT naics, est, emp AS EMP FROM state WHERE fipstate=:statefp",
         con=db,
         params={"statefp": statefp},
     )
@@ -46,6 +47,145 @@ def get_industries_by_state(*, db, statefp) -> Union[pandas.DataFrame, None]:
         return None
 
     df = df.rename(columns={"est": "establishments"})
-    df = df.astype({"establishments": "int32"})
-    df = df[df["naics"].str.contains(r"\d{6,6}")]
+    df = df.astype({"establishments": "int32", "EMP": "int32"})
+    return df
+
+
+def get_industries_by_zipcodes(*, db, zipcodes) -> pandas.DataFrame:
+    # One index seek per zipcode, with the zipcodes bound as a JSON array.
+    df = pandas.read_sql(
+        "SELECT zip AS zipcode, naics, est FROM json_each(:zipcodes) AS zipcodes "
+        "CROSS JOIN zipcode ON zipcode.zip = zipcodes.value",
+        con=db,
+        params={"zipcodes": json.dumps([int(x) for x in zipcodes])},
+    )
+
+    df = df.rename(columns={"est": "establishments"})
+    df = df.astype({"zipcode": "int64", "establishments": "int32"})
+    return df
+
+
+def get_industries_by_counties(*, db, geoids) -> pandas.DataFrame:
+    df = pandas.read_sql(
+        "SELECT fipstate AS statefp, fipscty AS countyfp, naics, est "
+        "FROM json_each(:geoids) AS geoids CROSS JOIN county "
+        "ON county.fipstate = geoids.value / 1000 "
+        "AND county.fipscty = geoids.value % 1000",
+        con=db,
+        params={"geoids": json.dumps([int(x) for x in geoids])},
+    )
+
+    df = df.rename(columns={"est": "establishments"})
+    df = df.astype({"statefp": "int64", "countyfp": "int64", "establishments": "int32"})
+    return df
+
+
+def get_all_industries_by_zipcode(*, db) -> pandas.DataFrame:
+    df = pandas.read_sql(
+        "SELECT zip AS zipcode, naics, est FROM zipcode",
+        con=db,
+    )
+
+    df = df.rename(columns={"est": "establishments"})
+    df = df.astype({"zipcode": "int64", "establishments": "int32"})
+    return df
+
+
+def get_all_industries_by_county(*, db) -> pandas.DataFrame:
+    df = pandas.read_sql(
+        "SELECT fipstate AS statefp, fipscty AS countyfp, naics, est FROM county",
+        con=db,
+    )
+
+    df = df.rename(columns={"est": "establishments"})
+    df = df.astype({"statefp": "int64", "countyfp": "int64", "establishments": "int32"})
     return df
+
+
+def get_all_industries_by_state(*, db) -> pandas.DataFrame:
+    df = pandas.read_sql(
+        "SELECT fipstate AS statefp, naics, est FROM state",
+        con=db,
+    )
+
+    df = df.rename(columns={"est": "establishments"})
+    df = df.astype({"statefp": "int64", "establishments": "int32"})
+    return df
+
+
+# Layout of the CBP tables, shared by the loader of the downloaded files
+# (utils/cbp) and `flask generate cbp`: each table's columns and types,
+# and the covering index of its lookups, so a request is a single index seek.
+SCHEMA = {
+    "county": {
+        "columns": {
+            "fipstate": "INTEGER",
+            "fipscty": "INTEGER",
+            "naics": "TEXT",
+            "emp": "INTEGER",
+            "est": "INTEGER",
+        },
+        "index": ["fipstate", "fipscty", "naics", "est"],
+    },
+    "state": {
+        "columns": {
+            "fipstate": "INTEGER",
+            "naics": "TEXT",
+            "emp": "INTEGER",
+            "est": "INTEGER",
+        },
+        "index": ["fipstate", "naics", "est"],
+    },
+    "zipcode": {
+        "columns": {
+            "zip": "INTEGER",
+            "name": "TEXT",
+            "naics": "TEXT",
+            "est": "INTEGER",
+        },
+        "index": ["zip", "naics", "est"],
+    },
+}
+
+# The Census API frame column filling each table column.
+API_COLUMNS = {
+    "county": {
+        "fipstate": "statefp",
+        "fipscty": "countyfp",
+        "naics": "naics",
+        "emp": "EMP",
+        "est": "establishments",
+    },
+    "state": {
+        "fipstate": "statefp",
+        "naics": "naics",
+        "emp": "EMP",
+        "est": "establishments",
+    },
+}
+
+
+def create_table(db, table):
+    columns = SCHEMA[table]["columns"]
+    definitions = ", ".join(f"{name} {kind} NOT NULL" for name, kind in columns.items())
+    db.execute(f"DROP TABLE IF EXISTS {table}")
+    db.execute(f"CREATE TABLE {table} ({definitions})")
+
+
+def insert_rows(db, table, rows):
+    placeholders = ", ".join("?" for _ in SCHEMA[table]["columns"])
+    db.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+
+
+def create_index(db, table):
+    index = SCHEMA[table]["index"]
+    db.execute(f"CREATE INDEX {table}_{index[0]} ON {table} ({', '.join(index)})")
+
+
+def write_industries(*, db, table, industries):
+    columns = [API_COLUMNS[table][name] for name in SCHEMA[table]["columns"]]
+
+    with db:
+        create_table(db, table)
+        insert_rows(db, table, industries[columns].itertuples(index=False, name=None))
+        create_index(db, table)
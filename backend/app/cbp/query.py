@@ -1,80 +1,136 @@
+import concurrent.futures
+import hashlib
+import json
+import os
 import requests
 import pandas
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+YEAR = "2019"
+VARIABLES = ["NAICS2017", "EMP", "ESTAB"]
 
 
 def urljoin(parts):
     return "/".join(part.strip("/") for part in parts)
 
 
-# https://api.census.gov/data/2019/cbp/variables.html
-def get_industries_by_zipcode(*, base_url, api_key, zipcode):
-    response = requests.get(
-        urljoin([base_url, "2019", "cbp"]),
-        params={
-            "get": ",".join(["NAICS2017", "EMP", "ESTAB"]),
-            "for": f"zipcode:{zipcode}",
-            "key": api_key,
-        },
+def make_session(*, pool_size=16, retries=5, backoff=0.5) -> requests.Session:
+    # Keep-alive connections shared by all fetches, retrying throttled and
+    # failed requests with exponential backoff.
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
     )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-    try:
-        data = response.json()
-    except ValueError:
-        print("Unable to parse county response as json. Returning empty DataFrame.")
-        return pandas.DataFrame()
 
+def get_cache_path(cache_dir, url, params):
+    # Keyed by the request without the API key, so the cache outlives it.
+    request = [url, sorted((k, v) for k, v in params.items() if k != "key")]
+    digest = hashlib.sha1(json.dumps(request).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{digest}.json")
+
+
+def fetch(*, session, base_url, api_key, geography, year=YEAR, cache_dir=None):
+    # Returns the API's table (a header row, then data rows) for one query.
+    # `geography` holds the "for" (and "in") predicates, which may use "*".
+    url = urljoin([base_url, year, "cbp"])
+    params = {"get": ",".join(VARIABLES), **geography, "key": api_key}
+
+    if cache_dir is not None:
+        filepath = get_cache_path(cache_dir, url, params)
+        try:
+            with open(filepath) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+
+    response = session.get(url, params=params, timeout=60)
+    response.raise_for_status()
+
+    # No content means no establishments match the query.
+    data = response.json() if response.content else [VARIABLES]
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(filepath + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(filepath + ".tmp", filepath)
+
+    return data
+
+
+def to_industries(data) -> pandas.DataFrame:
     df = pandas.DataFrame.from_records(data[1:], columns=data[0])
-    df = df.rename(columns={"ESTAB": "establishments", "NAICS2017":"naics"})
+    df = df.rename(columns={"ESTAB": "establishments", "NAICS2017": "naics"})
     df = df.astype({"establishments": "int32", "EMP": "int32"})
     df = df[df["naics"].str.len() == 6]
 
     return df
 
 
-def get_industries_by_county(*, base_url, api_key, statefp, countyfp):
-    response = requests.get(
-        urljoin([base_url, "2019", "cbp"]),
-        params={
-            "get": ",".join(["NAICS2017", "EMP", "ESTAB"]),
-            "for": f"county:{countyfp:03d}",
-            "in": f"state:{statefp:02d}",
-            "key": api_key,
-        },
-    )
-
+def get_industries(**kwargs) -> pandas.DataFrame:
     try:
-        data = response.json()
-    except ValueError:
-        print("Unable to parse county response as json. Returning empty DataFrame.")
+        data = fetch(**kwargs)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Unable to fetch {kwargs['geography']}: {e}. Returning empty DataFrame.")
         return pandas.DataFrame()
 
-    df = pandas.DataFrame.from_records(data[1:], columns=data[0])
-    df = df.rename(columns={"ESTAB": "establishments", "NAICS2017":"naics"})
-    df = df.astype({"establishments": "int32", "EMP": "int32"})
-    df = df[df["naics"].str.len() == 6]
+    return to_industries(data)
 
-    return df
 
+# https://api.census.gov/data/2019/cbp/variables.html
+def get_industries_by_zipcode(*, session, zipcode, **kwargs):
+    return get_industries(
+        session=session, geography={"for": f"zipcode:{zipcode}"}, **kwargs
+    )
 
-def get_industries_by_state(*, base_url, api_key, statefp):
-    response = requests.get(
-        urljoin([base_url, "2019", "cbp"]),
-        params={
-            "get": ",".join(["NAICS2017", "EMP", "ESTAB"]),
-            "for": f"state:{statefp:02d}",
-            "key": api_key,
-        },
+
+def get_industries_by_county(*, session, statefp, countyfp, **kwargs):
+    return get_industries(
+        session=session,
+        geography={"for": f"county:{countyfp:03d}", "in": f"state:{statefp:02d}"},
+        **kwargs,
     )
 
-    try:
-        data = response.json()
-    except ValueError:
-        print("Unable to parse state response as json. Returning empty DataFrame.")
-        return pandas.DataFrame()
 
-    df = pandas.DataFrame.from_records(data[1:], columns=data[0])
-    df = df.rename(columns={"ESTAB": "establishments", "NAICS2017":"naics"})
-    df = df.astype({"establishments": "int32", "EMP": "int32"})
-    df = df[df["naics"].str.len() == 6]
+def get_industries_by_state(*, session, statefp, **kwargs):
+    return get_industries(
+        session=session, geography={"for": f"state:{statefp:02d}"}, **kwargs
+    )
 
-    return df
+
+def get_all_industries_by_county(
+    *, session, statefps, workers=8, **kwargs
+) -> pandas.DataFrame:
+    # One wildcard query per state (every county in it), run concurrently.
+    def fetch_state(statefp):
+        return fetch(
+            session=session,
+            geography={"for": "county:*", "in": f"state:{statefp:02d}"},
+            **kwargs,
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        tables = list(executor.map(fetch_state, statefps))
+
+    df = pandas.concat([to_industries(data) for data in tables], ignore_index=True)
+    df = df.rename(columns={"state": "statefp", "county": "countyfp"})
+
+    return df.astype({"statefp": "int64", "countyfp": "int64"})
+
+
+def get_all_industries_by_state(*, session, **kwargs) -> pandas.DataFrame:
+    data = fetch(session=session, geography={"for": "state:*"}, **kwargs)
+    df = to_industries(data).rename(columns={"state": "statefp"})
+
+    return df.astype({"statefp": "int64"})
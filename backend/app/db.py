@@ -1,58 +1,148 @@
+import os
+import pathlib
 import sqlite3
-import spatialite
 
 from flask import current_app, g
+import app.gis.tiles
+from app.pool import ConnectionPool
+
+
+def connect_readonly(filepath, *, connect=sqlite3.connect, mmap_size, cache_size):
+    # Opened read-only and immutable, so SQLite skips locking and change
+    # detection, with the file memory-mapped. Pooled connections are handed
+    # between request threads, one request at a time.
+    uri = pathlib.Path(filepath).resolve().as_uri() + "?mode=ro&immutable=1"
+    db = connect(
+        uri,
+        uri=True,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False,
+    )
+    db.text_factory = lambda b: b.decode(errors="ignore")
+    db.row_factory = sqlite3.Row
+    db.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    db.execute(f"PRAGMA cache_size=-{int(cache_size) // 1024}")
+
+    return db
+
+
+def connect_spatialite(*args, **kwargs):
+    # Imported on first use: the module loads the SpatiaLite extension as it
+    # is imported, which requests reading only the CBP and impacts databases
+    # never need.
+    import spatialite
+
+    return spatialite.connect(*args, **kwargs)
+
+
+# The databases served from pools, by the config key holding their path, and
+# the function opening a connection to each.
+POOLED = {
+    "DATABASE": connect_spatialite,
+    "CBP_DATABASE": sqlite3.connect,
+    "IMPACTS_DATABASE": sqlite3.connect,
+}
+
+
+def get_pool(name):
+    filepath = current_app.config[name]
+    stat = os.stat(filepath)
+    version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    pools = current_app.extensions["db_pools"]
+    pool = pools.get(name)
+
+    # Immutable connections must not outlive the file they were opened on, so
+    # a replaced or regenerated database gets a fresh pool.
+    if pool is None or pool.version != version:
+        if pool is not None:
+            pool.close()
+
+        def connect():
+            return connect_readonly(
+                filepath,
+                connect=POOLED[name],
+                mmap_size=current_app.config["DB_MMAP_SIZE"],
+                cache_size=current_app.config["DB_CACHE_SIZE"],
+            )
+
+        pool = ConnectionPool(
+            connect, max_idle=current_app.config["DB_POOL_SIZE"], version=version
+        )
+        pools[name] = pool
 
+    return pool
 
-def get_db():
-    if "db" not in g:
-        g.db = spatialite.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.text_factory = lambda b: b.decode(errors="ignore")
-        g.db.row_factory = sqlite3.Row
 
-    return g.db
+def get_pooled_db(name):
+    if "pooled_dbs" not in g:
+        g.pooled_dbs = {}
 
+    if name not in g.pooled_dbs:
+        pool = get_pool(name)
+        g.pooled_dbs[name] = (pool, pool.acquire())
 
-def get_cbp_db():
-    if "cbp_db" not in g:
-        g.cbp_db = sqlite3.connect(
-            current_app.config["CBP_DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.cbp_db.text_factory = lambda b: b.decode(errors="ignore")
-        g.cbp_db.row_factory = sqlite3.Row
+    return g.pooled_dbs[name][1]
+
+
+def get_db():
+    return get_pooled_db("DATABASE")
 
-    return g.cbp_db
+
+def get_cbp_db():
+    return get_pooled_db("CBP_DATABASE")
 
 
 def get_impacts_db():
-    if "impacts_db" not in g:
-        g.impacts_db = sqlite3.connect(
-            current_app.config["IMPACTS_DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
+    return get_pooled_db("IMPACTS_DATABASE")
+
+
+def get_pool_stats() -> dict:
+    pools = current_app.extensions["db_pools"]
+    return {name: pool.stats() for name, pool in list(pools.items())}
+
+
+def get_tiles_pool(layer):
+    # The MBTiles file is set up once per process, when its pool is created;
+    # requests then read through the pool's long-lived connections.
+    pools = current_app.extensions["tiles_pools"]
+    pool = pools.get(layer)
+
+    if pool is None:
+        directory = current_app.config["TILES_CACHE"]
+        os.makedirs(directory, exist_ok=True)
+        filepath = os.path.join(directory, f"{layer}.mbtiles")
+        app.gis.tiles.create_mbtiles(filepath, layer)
+
+        pool = ConnectionPool(
+            lambda: app.gis.tiles.connect_mbtiles(filepath),
+            max_idle=current_app.config["DB_POOL_SIZE"],
         )
-        g.impacts_db.text_factory = lambda b: b.decode(errors="ignore")
-        g.impacts_db.row_factory = sqlite3.Row
+        pools[layer] = pool
 
-    return g.impacts_db
+    return pool
 
 
-def close_dbs():
-    db = g.pop("db", None)
+def get_tiles_db(layer):
+    if "tiles_dbs" not in g:
+        g.tiles_dbs = {}
 
-    if db is not None:
-        db.close()
+    if layer not in g.tiles_dbs:
+        pool = get_tiles_pool(layer)
+        g.tiles_dbs[layer] = (pool, pool.acquire())
 
-    cbp_db = g.pop("cbp_db", None)
+    return g.tiles_dbs[layer][1]
 
-    if cbp_db is not None:
-        cbp_db.close()
 
-    impacts_db = g.pop("impacts_db", None)
+def close_dbs(exception=None):
+    for pool, db in g.pop("pooled_dbs", {}).values():
+        pool.release(db)
 
-    if impacts_db is not None:
-        impacts_db.close()
+    for pool, tiles_db in g.pop("tiles_dbs", {}).values():
+        pool.release(tiles_db)
 
 
 def init_app(app):
+    app.extensions["db_pools"] = {}
+    app.extensions["tiles_pools"] = {}
     app.teardown_appcontext(close_dbs)
@@ -1,13 +1,63 @@
+import concurrent.futures
+import os
 import sqlite3
-import json
+import click
+import numpy
 import pandas
-from flask import Blueprint
+from flask import Blueprint, current_app, json
+import app.cbp.database
+import app.cbp.query
+import app.gis.tiles
 import app.operations
-from app.db import get_impacts_db
+import app.parquet
+import app.payloads
+import app.useeio.impacts
+import app.useeio.matrices
+from app.db import get_db, get_impacts_db, get_tiles_db
 
 blueprint = Blueprint("generate", __name__, url_prefix="/generate")
 
 
+@blueprint.cli.command("matrices")
+def generate_matrices():
+    target = app.useeio.matrices.compile_matrices()
+    print(f"Compiled USEEIO matrices into {target}")
+
+
+@blueprint.cli.command("payloads")
+def generate_payloads():
+    directory = current_app.config["INDEX_PAYLOADS"]
+    for name in app.operations.INDEXES:
+        body = json.dumps(app.operations.get_index(name)).encode()
+        app.payloads.write_payload(directory, name, app.payloads.compress(body))
+        print(f"Wrote {name} payload ({len(body)} bytes) to {directory}")
+
+
+@blueprint.cli.command("tiles")
+@click.option("--max-zoom", type=int, default=8, show_default=True)
+@click.option(
+    "--bounds",
+    nargs=4,
+    type=float,
+    default=(-180.0, 17.0, -64.0, 72.0),
+    show_default=True,
+    help="Seed tiles covering this lon/lat box (x1 y1 x2 y2).",
+)
+@click.argument("layers", nargs=-1, type=click.Choice(list(app.gis.tiles.LAYERS)))
+def generate_tiles(max_zoom, bounds, layers):
+    for layer in layers or app.gis.tiles.LAYERS:
+        config = app.gis.tiles.LAYERS[layer]
+        mbtiles = get_tiles_db(layer)
+        for z in range(config["minzoom"], min(max_zoom, config["maxzoom"]) + 1):
+            count = 0
+            for x, y in app.gis.tiles.lonlat_tiles(z, *bounds):
+                app.gis.tiles.get_tile(
+                    db=get_db(), mbtiles=mbtiles, layer=layer, z=z, x=x, y=y
+                )
+                count += 1
+            print(f"Seeded {count} {layer} tiles at zoom {z}")
+
+
 @blueprint.cli.command("counties-json")
 def generate_counties_json():
     for row in app.operations.get_all_counties().itertuples():
@@ -21,62 +71,442 @@ def generate_counties_json():
         df.to_parquet(fname)
 
 
+# Each level is written to its own table, with one checkpoint row per
+# geography (identified by `id`) committed in the same transaction as its
+# impact rows, so an interrupted run resumes without duplicating rows.
+LEVELS = {
+    "zipcode": {
+        "keys": app.operations.ZIPCODE_KEYS,
+        "id": "zipcode",
+        "indexes": {"zipcode_zipcode": ["zipcode"]},
+        "industries": app.operations.all_industries_by_zipcode,
+    },
+    "county": {
+        "keys": app.operations.COUNTY_KEYS,
+        "id": "geoid",
+        "indexes": {"county_statefp_countyfp": ["statefp", "countyfp"]},
+        "industries": app.operations.all_industries_by_county,
+    },
+    "state": {
+        "keys": app.operations.STATE_KEYS,
+        "id": "statefp",
+        "indexes": {"state_statefp": ["statefp"]},
+        "industries": app.operations.all_industries_by_state,
+    },
+}
+
+# Coarser tables rolled up from a level's rows once it is generated, with
+# the columns dropped from the finer geography and the lookup index.
+ROLLUPS = {
+    "state_rollup": {
+        "source": "county",
+        "keys": ["statefp"],
+        "drop": ["countyfp", "geoid"],
+        "indexes": {"state_rollup_statefp": ["statefp"]},
+    },
+}
+
+worker_naics_impacts = None
+
+
+def init_worker(naics_impacts):
+    global worker_naics_impacts
+    worker_naics_impacts = naics_impacts
+
+
+def compute_chunk(industries, keys):
+    matrix = app.useeio.impacts.build_establishment_matrix(
+        industries, worker_naics_impacts, keys=keys
+    )
+    return app.useeio.impacts.gather_geography_impacts(matrix, worker_naics_impacts)
+
+
+def get_completed(con, level):
+    rows = con.execute("SELECT geography FROM checkpoint WHERE level=?", (level,))
+    return set(row[0] for row in rows)
+
+
+def clear_level(con, level):
+    with con:
+        con.execute(f"DROP TABLE IF EXISTS {level}")
+        con.execute("DELETE FROM checkpoint WHERE level=?", (level,))
+
+
+def split_geographies(industries, id_key, batch_size):
+    industries = industries.sort_values(id_key, kind="stable")
+    ids, starts = numpy.unique(industries[id_key].to_numpy(), return_index=True)
+    bounds = list(starts[::batch_size]) + [industries.shape[0]]
+
+    for chunk, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        chunk_ids = ids[chunk * batch_size : (chunk + 1) * batch_size]
+        yield [str(x) for x in chunk_ids], industries.iloc[start:end]
+
+
+def connect_for_writing(database):
+    con = sqlite3.connect(database)
+    # WAL keeps each batch commit atomic (and so resumable) without the
+    # rollback journal's extra copy of every page; NORMAL sync only defers
+    # the fsync to checkpoints.
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA cache_size=-262144")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS checkpoint (level TEXT, geography TEXT, "
+        "PRIMARY KEY (level, geography))"
+    )
+    return con
+
+
+def bulk_insert(con, table, df):
+    # Create the table from the frame's dtypes once, then insert through a
+    # single prepared statement rather than to_sql's per-call setup.
+    df.head(0).to_sql(table, con, if_exists="append", index=False)
+    columns = ", ".join(f'"{x}"' for x in df.columns)
+    placeholders = ", ".join("?" for _ in df.columns)
+    con.executemany(
+        f'INSERT INTO "{table}" ({columns}) VALUES ({placeholders})',
+        df.itertuples(index=False, name=None),
+    )
+
+
+def write_chunk(con, level, ids, df):
+    with con:
+        if df.shape[0] > 0:
+            bulk_insert(con, level, df)
+        con.executemany(
+            "INSERT INTO checkpoint (level, geography) VALUES (?, ?)",
+            [(level, x) for x in ids],
+        )
+
+
+def build_indexes(con, level):
+    # The serving queries look rows up by these keys; afterwards switch back
+    # to a rollback journal so the file can be opened read-only on its own.
+    for name, columns in LEVELS[level]["indexes"].items():
+        con.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{level}" ({", ".join(columns)})'
+        )
+    con.execute(f'ANALYZE "{level}"')
+    con.commit()
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    con.execute("PRAGMA journal_mode=DELETE")
+
+
+def build_rollup(con, name):
+    # Rolled up one group at a time, reading each through the source's index.
+    config = ROLLUPS[name]
+    keys = config["keys"]
+    groups = con.execute(
+        f'SELECT DISTINCT {", ".join(keys)} FROM "{config["source"]}"'
+    ).fetchall()
+    where = " AND ".join(f"{key}=?" for key in keys)
+
+    with con:
+        con.execute(f'DROP TABLE IF EXISTS "{name}"')
+        for group in groups:
+            rows = pandas.read_sql(
+                f'SELECT * FROM "{config["source"]}" WHERE {where}',
+                con,
+                params=group,
+            )
+            rollup = app.useeio.impacts.rollup_impacts(
+                rows.drop(config["drop"], axis=1), keys=keys
+            )
+            bulk_insert(con, name, rollup)
+
+    for index, columns in config["indexes"].items():
+        con.execute(f'CREATE INDEX "{index}" ON "{name}" ({", ".join(columns)})')
+    con.execute(f'ANALYZE "{name}"')
+    con.commit()
+    print(f"Rolled {len(groups)} groups of {config['source']} up into {name}")
+
+
+def build_ranking(con, table, *, indicators, depth):
+    # Ranks each geography's industries by their contribution to every
+    # indicator (its intensity times the industry's establishments), keeping
+    # the top `depth` so a top-N request reads a bounded slice.
+    keys = ", ".join(app.operations.RANKINGS[table])
+    name = f"{table}_rank"
+
+    with con:
+        con.execute(f'DROP TABLE IF EXISTS "{name}"')
+        con.execute(
+            f'CREATE TABLE "{name}" AS SELECT {keys}, naics, '
+            "'' AS indicator, 0 AS rank "
+            f'FROM "{table}" WHERE 0'
+        )
+        for code, column in indicators.items():
+            con.execute(
+                f'INSERT INTO "{name}" SELECT * FROM ('
+                f"SELECT {keys}, naics, :code, ROW_NUMBER() OVER ("
+                f'PARTITION BY {keys} ORDER BY "{column}" * establishments DESC, '
+                f'naics) AS rank FROM "{table}") WHERE rank <= :depth',
+                {"code": code, "depth": depth},
+            )
+        con.execute(
+            f'CREATE INDEX "{name}_{table}" ON "{name}" ({keys}, indicator, rank)'
+        )
+        con.execute(f'ANALYZE "{name}"')
+
+    count = con.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0]
+    print(f"Ranked {table} by {len(indicators)} indicators into {count} rows")
+
+
+def build_distribution(con, level, *, indicators):
+    # Each geography's indicator totals (intensity times establishments,
+    # summed over its industries) in <level>_totals, and every indicator's
+    # totals sorted across the level in `distribution`, so a percentile is a
+    # lookup and a binary search.
+    keys = ", ".join(app.operations.BENCHMARKS[level])
+    columns = ", ".join(
+        f'SUM("{column}" * establishments) AS "{code}"'
+        for code, column in indicators.items()
+    )
+    name = f"{level}_totals"
+
+    with con:
+        con.execute(f'DROP TABLE IF EXISTS "{name}"')
+        con.execute(
+            f'CREATE TABLE "{name}" AS SELECT {keys}, {columns} '
+            f'FROM "{level}" GROUP BY {keys}'
+        )
+        con.execute(f'CREATE INDEX "{name}_{level}" ON "{name}" ({keys})')
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS distribution (level TEXT, indicator TEXT, "
+            "totals BLOB, PRIMARY KEY (level, indicator))"
+        )
+        for code in indicators:
+            totals = [row[0] for row in con.execute(f'SELECT "{code}" FROM "{name}"')]
+            con.execute(
+                "INSERT OR REPLACE INTO distribution VALUES (?, ?, ?)",
+                (level, code, numpy.sort(numpy.array(totals, dtype="<f8")).tobytes()),
+            )
+
+    count = con.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0]
+    print(f"Built distributions of {count} {level} totals")
+
+
+def compute_level(con, level, *, workers, batch_size):
+    config = LEVELS[level]
+    completed = get_completed(con, level)
+    industries = config["industries"]()
+    ids = industries[config["id"]].astype(str)
+    pending = industries[~ids.isin(completed)]
+    total = pending[config["id"]].nunique()
+    print(f"{len(completed)} {level} geographies done, {total} remaining")
+
+    chunks = split_geographies(pending, config["id"], batch_size)
+    naics_impacts = app.operations.get_naics_impacts()
+    written = 0
+
+    if workers <= 1:
+        init_worker(naics_impacts)
+        for ids, chunk in chunks:
+            write_chunk(con, level, ids, compute_chunk(chunk, config["keys"]))
+            written += len(ids)
+            print(f"Wrote {written}/{total} {level} geographies")
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(naics_impacts,)
+    ) as executor:
+        futures = {
+            executor.submit(compute_chunk, chunk, config["keys"]): ids
+            for ids, chunk in chunks
+        }
+        for future in concurrent.futures.as_completed(futures):
+            ids = futures[future]
+            write_chunk(con, level, ids, future.result())
+            written += len(ids)
+            print(f"Wrote {written}/{total} {level} geographies")
+
+
+def generate_level(level, *, database, workers, batch_size, ranking_depth, restart):
+    con = connect_for_writing(database)
+
+    try:
+        if restart:
+            clear_level(con, level)
+
+        compute_level(con, level, workers=workers, batch_size=batch_size)
+        print(f"Building indexes for {level}")
+        build_indexes(con, level)
+
+        indicators = app.operations.get_indicator_columns()
+        for name, rollup in ROLLUPS.items():
+            if rollup["source"] == level:
+                build_rollup(con, name)
+        for table in app.operations.RANKINGS:
+            if table == level or ROLLUPS.get(table, {}).get("source") == level:
+                build_ranking(con, table, indicators=indicators, depth=ranking_depth)
+        if level in app.operations.BENCHMARKS:
+            build_distribution(con, level, indicators=indicators)
+    finally:
+        con.close()
+
+
+def ranking_depth_option(name):
+    return click.option(
+        name,
+        type=click.IntRange(1, app.operations.RANKING_DEPTH),
+        default=app.operations.RANKING_DEPTH,
+        show_default=True,
+        help="Top industries ranked per geography and indicator, up to the "
+        "largest limit /top serves. The ranking table holds up to this many "
+        "rows per indicator for every geography: at the default, tens of "
+        "millions at zipcode level.",
+    )
+
+
+def generate_options(command):
+    command = click.option(
+        "--database",
+        default="impacts.sqlite3",
+        show_default=True,
+        help="Impacts database to write.",
+    )(command)
+    command = click.option(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        show_default=True,
+        help="Number of worker processes computing impacts.",
+    )(command)
+    command = click.option(
+        "--batch-size",
+        type=int,
+        default=500,
+        show_default=True,
+        help="Geographies computed and committed together.",
+    )(command)
+    command = ranking_depth_option("--ranking-depth")(command)
+    command = click.option(
+        "--restart",
+        is_flag=True,
+        help="Discard previously generated rows and checkpoints for this level.",
+    )(command)
+    return command
+
+
+@blueprint.cli.command("parquet")
+@click.option("--database", default="impacts.sqlite3", show_default=True)
+@click.option("--output", default="impacts.parquet", show_default=True)
+@click.argument("levels", nargs=-1, type=click.Choice(list(app.parquet.LAYOUTS)))
+def generate_parquet(database, output, levels):
+    with sqlite3.connect(database) as con:
+        for level in levels or app.parquet.LAYOUTS:
+            exported = app.parquet.export_dataset(db=con, level=level, root=output)
+            for partition, rows in exported:
+                print(f"Exported {rows} {level} rows for partition {partition}")
+
+
+@blueprint.cli.command("cbp")
+@click.option("--database", default="cbp.sqlite3", show_default=True)
+@click.option("--year", default=app.cbp.query.YEAR, show_default=True)
+@click.option("--workers", type=int, default=8, show_default=True)
+@click.argument(
+    "levels", nargs=-1, type=click.Choice(list(app.cbp.database.API_COLUMNS))
+)
+def generate_cbp(database, year, workers, levels):
+    # Pulls a CBP year from the Census API: all states in one query, and the
+    # counties with one wildcard query per state, fetched concurrently.
+    options = app.operations.get_census_options() | {"year": year}
+    fetchers = {
+        "county": lambda: app.cbp.query.get_all_industries_by_county(
+            statefps=app.operations.get_all_states()["statefp"].tolist(),
+            workers=workers,
+            **options,
+        ),
+        "state": lambda: app.cbp.query.get_all_industries_by_state(**options),
+    }
+
+    with sqlite3.connect(database) as con:
+        for level in levels or app.cbp.database.API_COLUMNS:
+            industries = fetchers[level]()
+            app.cbp.database.write_industries(
+                db=con, table=level, industries=industries
+            )
+            print(f"Wrote {len(industries)} {level} rows for {year} to {database}")
+
+
 @blueprint.cli.command("zipcodes")
-def generate_zipcodes():
-    with sqlite3.connect("impacts.sqlite3") as con:
-        for row in app.operations.get_all_zipcodes().itertuples():
-            try:
-                print(row)
-                df = app.operations.compute_direct_industry_impacts_by_zipcode(
-                    zipcode=row.zipcode
-                )
-                if df is None:
-                    continue
-                df["zipcode"] = row.zipcode
-                df.to_sql("zipcode", con, if_exists="append", index_label="zipcode")
-            except ValueError:
-                print("Failed for zipcode:", row.zipcode)
+@generate_options
+def generate_zipcodes(**options):
+    generate_level("zipcode", **options)
 
 
 @blueprint.cli.command("counties")
-def generate_counties():
-    with sqlite3.connect("impacts.sqlite3") as con:
-        for row in app.operations.get_all_counties().itertuples():
-            try:
-                print(row)
-                df = app.operations.compute_direct_industry_impacts_by_county(
-                    statefp=row.statefp, countyfp=row.countyfp
-                )
-                if df is None:
-                    continue
-                df["countyfp"] = row.countyfp
-                df["statefp"] = row.statefp
-                df["geoid"] = row.geoid
-                df.to_sql(
-                    "county",
-                    con,
-                    if_exists="append",
-                    index=False,
-                )
-            except ValueError as e:
-                print(
-                    f"Failed for state/{row.statefp}/county/{row.countyfp}",
-                )
-                print(e)
+@generate_options
+def generate_counties(**options):
+    generate_level("county", **options)
 
 
 @blueprint.cli.command("states")
-def generate_states():
-    with sqlite3.connect("impacts.sqlite3") as con:
-        for row in app.operations.get_all_states().itertuples():
-            try:
-                print(row)
-                df = app.operations.compute_direct_industry_impacts_by_state(
-                    statefp=row.statefp, sample_size=50
-                )
-                if df is None:
-                    continue
-                df["statefp"] = row.statefp
-                df.to_sql("state", con, if_exists="append", index_label="statefp")
-            except ValueError:
-                print(f"Failed for state/{row.statefp}")
+@generate_options
+def generate_states(**options):
+    generate_level("state", **options)
+
+
+@blueprint.cli.command("rollups")
+@click.option("--database", default="impacts.sqlite3", show_default=True)
+def generate_rollups(database):
+    con = connect_for_writing(database)
+
+    try:
+        for name in ROLLUPS:
+            build_rollup(con, name)
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        con.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        con.close()
+
+
+@blueprint.cli.command("rankings")
+@click.option("--database", default="impacts.sqlite3", show_default=True)
+@ranking_depth_option("--depth")
+def generate_rankings(database, depth):
+    con = connect_for_writing(database)
+
+    try:
+        indicators = app.operations.get_indicator_columns()
+        for table in app.operations.RANKINGS:
+            if con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+            ).fetchone():
+                build_ranking(con, table, indicators=indicators, depth=depth)
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        con.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        con.close()
+
+
+@blueprint.cli.command("distributions")
+@click.option("--database", default="impacts.sqlite3", show_default=True)
+def generate_distributions(database):
+    con = connect_for_writing(database)
+
+    try:
+        indicators = app.operations.get_indicator_columns()
+        for level in app.operations.BENCHMARKS:
+            build_distribution(con, level, indicators=indicators)
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        con.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        con.close()
+
+
+@blueprint.cli.command("indexes")
+@click.option("--database", default="impacts.sqlite3", show_default=True)
+def generate_indexes(database):
+    con = connect_for_writing(database)
+
+    try:
+        for level in LEVELS:
+            if con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (level,)
+            ).fetchone():
+                print(f"Building indexes for {level}")
+                build_indexes(con, level)
+    finally:
+        con.close()
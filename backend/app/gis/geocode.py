@@ -0,0 +1,86 @@
+import shapely.prepared
+import shapely.wkb
+from shapely.geometry import Point
+from shapely.strtree import STRtree
+
+# Polygon layers points are located in: the shapefile table holding the
+# geometries and the columns reported for a match, renamed. utils/spatial
+# loads these tables simplified to 2% of their vertices (mapshaper dp 2%),
+# so points near a boundary may be placed in the neighbouring polygon.
+LAYERS = {
+    "zcta": {
+        "table": "zcta_shp",
+        "columns": {"ZCTA5CE20": "zipcode"},
+    },
+    "county": {
+        "table": "county_shp",
+        "columns": {
+            "cast(COUNTYFP as INTEGER)": "countyfp",
+            "cast(GEOID as INTEGER)": "county_geoid",
+        },
+    },
+    "state": {
+        "table": "state_shp",
+        "columns": {"cast(STATEFP as INTEGER)": "statefp", "NAME": "state_name"},
+    },
+}
+
+
+def build_index(geometries, values) -> dict:
+    # An STR-packed tree over the polygons' boxes, with each polygon prepared
+    # for the exact test and `values` (one dict per polygon) to report.
+    return {
+        "tree": STRtree(geometries),
+        "prepared": [shapely.prepared.prep(geometry) for geometry in geometries],
+        "values": values,
+    }
+
+
+def load_index(*, db, layer) -> dict:
+    config = LAYERS[layer]
+    columns = ", ".join(f"{sql} AS {name}" for sql, name in config["columns"].items())
+    rows = db.execute(
+        f"SELECT {columns}, AsBinary(geometry) AS wkb FROM {config['table']}"
+        " WHERE geometry IS NOT NULL"
+    ).fetchall()
+
+    return build_index(
+        [shapely.wkb.loads(bytes(row["wkb"])) for row in rows],
+        [{name: row[name] for name in config["columns"].values()} for row in rows],
+    )
+
+
+def load_indexes(*, db) -> dict:
+    return {layer: load_index(db=db, layer=layer) for layer in LAYERS}
+
+
+def locate(index, point):
+    # Points on a shared boundary go to the first polygon the tree yields.
+    for item in index["tree"].query_items(point):
+        if index["prepared"][item].intersects(point):
+            return index["values"][item]
+
+    return None
+
+
+def geocode(indexes, points) -> list:
+    # One record per (lon, lat) point, with the columns of every layer and
+    # None for those whose polygons do not contain it. Repeated coordinates
+    # are located once.
+    empty = {
+        name: None for config in LAYERS.values() for name in config["columns"].values()
+    }
+    located = {}
+    results = []
+
+    for lon, lat in points:
+        values = located.get((lon, lat))
+        if values is None:
+            point = Point(lon, lat)
+            values = empty.copy()
+            for index in indexes.values():
+                values |= locate(index, point) or {}
+            located[(lon, lat)] = values
+        results.append({"lon": lon, "lat": lat} | values)
+
+    return results
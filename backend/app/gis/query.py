@@ -1,67 +1,427 @@
 import json
 import pandas
 
+# GeoJSON tables built by utils/spatial, from most to least detailed, each
+# with the lowest map zoom it is served at. Requests without a zoom get the
+# most detailed table.
+RESOLUTIONS = {
+    "zcta": [(10, "zcta_geojson"), (7, "zcta_geojson_3"), (0, "zcta_geojson_1")],
+    "county": [
+        (8, "county_geojson"),
+        (5, "county_geojson_3"),
+        (0, "county_geojson_1"),
+    ],
+}
 
-def get_zctas_intersecting_mbr(*, db, mbr):
+
+def get_geojson_table(layer, zoom=None, *, db=None):
+    # With a db, a simplified table it lacks (databases built before they
+    # were added) falls back to the next more detailed one.
+    # The tables from the most detailed to the one served at `zoom`.
+    tables = [table for _, table in RESOLUTIONS[layer]]
+    if zoom is None:
+        tables = tables[:1]
+    else:
+        served = [zoom >= min_zoom for min_zoom, _ in RESOLUTIONS[layer]]
+        if True in served:
+            tables = tables[: served.index(True) + 1]
+
+    if db is not None:
+        existing = {
+            row[0]
+            for row in db.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' "
+                "AND name IN (SELECT value FROM json_each(:tables))",
+                {"tables": json.dumps(tables)},
+            )
+        }
+        tables = [x for x in tables if x in existing] or tables[:1]
+
+    return tables[-1]
+
+
+def get_search_frame(mbr) -> dict:
+    # Corners may arrive in either order; the R*Tree comparisons need min/max.
+    return {
+        "xmin": min(mbr["x1"], mbr["x2"]),
+        "ymin": min(mbr["y1"], mbr["y2"]),
+        "xmax": max(mbr["x1"], mbr["x2"]),
+        "ymax": max(mbr["y1"], mbr["y2"]),
+    }
+
+
+def search_frame_sql(table, *, exact=False):
+    # Filters the R*Tree that CreateSpatialIndex built for the shapefile
+    # table (aliased idx), so only boxes overlapping the frame are visited.
+    # With exact=True the candidates are refined with a true geometry test.
     sql = """
-    SELECT
-      zcta_geojson.ZCTA5CE20,
-      zcta_geojson.geometry
-    FROM
-      zcta_geojson
-      INNER JOIN (
-        SELECT
-          ZCTA5CE20
-        FROM
-          zcta_shp
-        WHERE
-          MBRIntersects(BuildMBR(:x1,:y1,:x2,:y2, 4326), "geometry")
-      ) AS zcta_shp ON zcta_geojson.ZCTA5CE20 = zcta_shp.ZCTA5CE20
+      idx.xmin <= :xmax AND idx.xmax >= :xmin
+      AND idx.ymin <= :ymax AND idx.ymax >= :ymin
+    """
+
+    if exact:
+        sql += f"""
+      AND Intersects(
+        {table}.geometry, BuildMBR(:xmin,:ymin,:xmax,:ymax, 4326)
+      )
+    """
+
+    return sql
+
+
+def get_previous_frame(previous) -> dict:
+    return {f"p{name}": value for name, value in get_search_frame(previous).items()}
+
+
+def incremental_sql(table, key, *, exact=False, known=False, previous=False):
+    # Leaves out features the client already holds: ids listed in :known (a
+    # JSON array) and features that met the previous frame (the p-prefixed
+    # bounds), which the last response held if it was made with the same
+    # `exact` and answered in full.
+    sql = ""
+
+    if known:
+        sql += f"""
+      AND {key} NOT IN (SELECT value FROM json_each(:known))
+    """
+
+    if previous and exact:
+        sql += f"""
+      AND NOT Intersects(
+        {table}.geometry, BuildMBR(:pxmin,:pymin,:pxmax,:pymax, 4326)
+      )
+    """
+    elif previous:
+        sql += """
+      AND NOT (
+        idx.xmin <= :pxmax AND idx.xmax >= :pxmin
+        AND idx.ymin <= :pymax AND idx.ymax >= :pymin
+      )
     """
 
-    rows = db.execute(sql, mbr).fetchall()
+    return sql
+
 
+def get_query_params(mbr, *, known=None, previous=None) -> dict:
+    params = get_search_frame(mbr)
+
+    if known is not None:
+        params["known"] = json.dumps(list(known))
+
+    if previous is not None:
+        params |= get_previous_frame(previous)
+
+    return params
+
+
+def zcta_properties(row):
+    return {"zipcode": row["ZCTA5CE20"]}
+
+
+def county_properties(row):
     return {
-        "results": [
-            {"zipcode": row["ZCTA5CE20"], "geometry": json.loads(row["geometry"])}
-            for row in rows
-        ]
+        "statefp": row["STATEFP"],
+        "countyfp": row["COUNTYFP"],
+        "county_name": row["county_name"],
+        "state_name": row["state_name"],
+        "geoid": row["GEOID"],
+        "name": row["NAME"],
     }
 
 
-def get_counties_intersecting_mbr(*, db, mbr):
-    sql = """
-    SELECT
+# The pieces of each layer's MBR query: the shapefile table holding the R*Tree,
+# the id clients hold for incremental requests, the selected columns and the
+# joins reaching them ({geojson} is the table for the requested zoom).
+MBR_LAYERS = {
+    "zcta": {
+        "table": "zcta_shp",
+        "key": "zcta_shp.ZCTA5CE20",
+        "columns": "zcta_geojson.ZCTA5CE20",
+        "joins": """
+      CROSS JOIN {geojson} AS zcta_geojson
+        ON zcta_geojson.ZCTA5CE20 = zcta_shp.ZCTA5CE20
+        """,
+        "geometry": "zcta_geojson.geometry",
+        "properties": zcta_properties,
+    },
+    "county": {
+        "table": "county_shp",
+        "key": "cast(county_shp.GEOID as INTEGER)",
+        "columns": """
       cast(county_geojson.STATEFP as INTEGER) as STATEFP,
       cast(county_geojson.COUNTYFP as INTEGER) as COUNTYFP,
       cast(county_geojson.GEOID as INTEGER) as GEOID,
       county_geojson.NAME,
-      county_geojson.geometry,
       county_fips.county_name,
       county_fips.state_name
-    FROM
-      county_geojson
-      INNER JOIN (
-        SELECT
-          STATEFP,
-          COUNTYFP,
-          GEOID
-        FROM
-          county_shp
-        WHERE
-          MBRIntersects(BuildMBR(:x1,:y1,:x2,:y2, 4326), "geometry")
-      ) AS county_shp ON county_geojson.GEOID = county_shp.GEOID
+        """,
+        "joins": """
+      CROSS JOIN {geojson} AS county_geojson
+        ON county_geojson.GEOID = county_shp.GEOID
       INNER JOIN county_fips ON county_fips.fips = county_geojson.GEOID
+        """,
+        "geometry": "county_geojson.geometry",
+        "properties": county_properties,
+    },
+}
+
+# A point at the center of the feature's box, read from the R*Tree alone.
+CENTROID_SQL = """json_object(
+        'type', 'Point',
+        'coordinates', json_array((idx.xmin + idx.xmax) / 2, (idx.ymin + idx.ymax) / 2)
+      )"""
+
+
+def intersecting_mbr_sql(
+    layer,
+    zoom=None,
+    *,
+    exact=False,
+    known=False,
+    previous=False,
+    paginate=False,
+    centroids=False,
+    db=None,
+):
+    # CROSS JOIN keeps SQLite from reordering: the R*Tree drives the query,
+    # then rowid and indexed-key lookups fetch the matching rows. Paginated
+    # queries first pick the page's ids past :cursor, so that only up to
+    # :limit geometries are read and sorted.
+    config = MBR_LAYERS[layer]
+    table = config["table"]
+    joins = f"""
+      CROSS JOIN {table} ON {table}.ROWID = idx.pkid
+      {config["joins"].format(geojson=get_geojson_table(layer, zoom, db=db))}
+    """
+    filters = search_frame_sql(table, exact=exact) + incremental_sql(
+        table, config["key"], exact=exact, known=known, previous=previous
+    )
+    geometry = CENTROID_SQL if centroids else config["geometry"]
+    select = f"""
+    SELECT
+      idx.pkid,
+      {config["columns"]},
+      {geometry} AS geometry
+    """
+
+    if paginate:
+        return f"""
+    WITH page AS (
+      SELECT idx.pkid
+      FROM idx_{table}_geometry AS idx {joins}
+      WHERE {filters} AND idx.pkid > :cursor
+      ORDER BY idx.pkid
+      LIMIT :limit
+    )
+    {select}
+    FROM
+      page
+      CROSS JOIN idx_{table}_geometry AS idx ON idx.pkid = page.pkid
+      {joins}
+    ORDER BY idx.pkid
+    """
+
+    return f"""
+    {select}
+    FROM
+      idx_{table}_geometry AS idx
+      {joins}
+    WHERE
+      {filters}
+    """
+
+
+def stream_feature_collection(
+    rows, properties, *, limit=None, members=None, chunk_size=65536
+):
+    # Writes a GeoJSON FeatureCollection from a cursor, splicing the stored
+    # GeoJSON geometry text in as-is and yielding output in ~chunk_size pieces.
+    # With a limit, a full page ends with the cursor of the next one; other
+    # top-level members are appended after the features.
+    chunk = ['{"type":"FeatureCollection","features":[']
+    length = 0
+    separator = ""
+    count = 0
+    last = None
+
+    for row in rows:
+        feature = (
+            f'{separator}{{"type":"Feature","properties":'
+            f'{json.dumps(properties(row))},"geometry":{row["geometry"] or "null"}}}'
+        )
+        chunk.append(feature)
+        length += len(feature)
+        separator = ","
+        count += 1
+        last = row["pkid"]
+
+        if length >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            length = 0
+
+    chunk.append("]")
+    if limit is not None:
+        chunk.append(f',"next":{json.dumps(last if count == limit else None)}')
+    for name, value in (members or {}).items():
+        chunk.append(f",{json.dumps(name)}:{json.dumps(value)}")
+    chunk.append("}")
+    yield "".join(chunk)
+
+
+def get_intersecting_mbr(
+    layer, *, db, mbr, zoom=None, exact=False, known=None, previous=None
+):
+    sql = intersecting_mbr_sql(
+        layer,
+        zoom,
+        exact=exact,
+        known=known is not None,
+        previous=previous is not None,
+        db=db,
+    )
+    params = get_query_params(mbr, known=known, previous=previous)
+    properties = MBR_LAYERS[layer]["properties"]
+
+    return {
+        "results": [
+            properties(row) | {"geometry": json.loads(row["geometry"])}
+            for row in db.execute(sql, params)
+        ]
+    }
+
+
+def count_intersecting_mbr(layer, *, db, mbr, zoom, limit) -> int:
+    # The features meeting a frame, counted from the R*Tree up to limit + 1.
+    sql = intersecting_mbr_sql(layer, zoom, centroids=True, db=db)
+    params = get_search_frame(mbr) | {"limit": limit}
+    return db.execute(
+        f"SELECT count(*) FROM ({sql} LIMIT :limit + 1)", params
+    ).fetchone()[0]
+
+
+def stream_intersecting_mbr(
+    layer,
+    *,
+    db,
+    mbr,
+    limit,
+    centroid_limit,
+    cursor=None,
+    centroids=False,
+    zoom=None,
+    exact=False,
+    known=None,
+    previous=None,
+):
+    # A request never reads more than `limit` geometries. With a cursor (0 for
+    # the first page) it gets the next page of features; without one, a
+    # frame holding more than `limit` features gets their centroids instead.
+    # Centroids are paged too, `centroid_limit` at a time: later pages are
+    # requested with the cursor and centroids=True.
+    if previous is not None:
+        # The client holds the previous frame's features only if it was
+        # answered in full: one holding more than `limit` features got
+        # centroids or pages, so the whole frame is queried instead.
+        count = count_intersecting_mbr(
+            layer, db=db, mbr=previous, zoom=zoom, limit=limit
+        )
+        if count > limit:
+            previous = None
+
+    options = {
+        "exact": exact,
+        "known": known is not None,
+        "previous": previous is not None,
+        "db": db,
+    }
+    params = get_query_params(mbr, known=known, previous=previous)
+    params |= {"limit": limit, "cursor": cursor}
+    properties = MBR_LAYERS[layer]["properties"]
+
+    def centroid_page(cursor):
+        sql = intersecting_mbr_sql(
+            layer, zoom, paginate=True, centroids=True, **options
+        )
+        rows = db.execute(sql, params | {"limit": centroid_limit, "cursor": cursor})
+        return stream_feature_collection(
+            rows, properties, limit=centroid_limit, members={"centroids": True}
+        )
+
+    if cursor is not None and centroids:
+        return centroid_page(cursor)
+
+    if cursor is not None:
+        sql = intersecting_mbr_sql(layer, zoom, paginate=True, **options)
+        return stream_feature_collection(
+            db.execute(sql, params), properties, limit=limit
+        )
+
+    centroids_sql = intersecting_mbr_sql(layer, zoom, centroids=True, **options)
+    count = db.execute(
+        f"SELECT count(*) FROM ({centroids_sql} LIMIT :limit + 1)", params
+    ).fetchone()[0]
+
+    if count > limit:
+        return centroid_page(0)
+
+    sql = intersecting_mbr_sql(layer, zoom, **options)
+    return stream_feature_collection(db.execute(sql, params), properties)
+
+
+def get_zctas_intersecting_mbr(*, db, mbr, **options):
+    return get_intersecting_mbr("zcta", db=db, mbr=mbr, **options)
+
+
+def get_counties_intersecting_mbr(*, db, mbr, **options):
+    return get_intersecting_mbr("county", db=db, mbr=mbr, **options)
+
+
+def get_ids_within_polygon(*, db, layer, polygon) -> list:
+    # Ids of the layer's features whose representative point lies inside a
+    # GeoJSON polygon, with the polygon's box narrowing the R*Tree search.
+    config = MBR_LAYERS[layer]
+    table = config["table"]
+    sql = f"""
+    WITH region AS (
+      SELECT SetSRID(GeomFromGeoJSON(:polygon), 4326) AS geometry
+    )
+    SELECT
+      {config["key"]} AS id
+    FROM
+      region
+      CROSS JOIN idx_{table}_geometry AS idx
+      CROSS JOIN {table} ON {table}.ROWID = idx.pkid
+    WHERE
+      idx.xmin <= MbrMaxX(region.geometry) AND idx.xmax >= MbrMinX(region.geometry)
+      AND idx.ymin <= MbrMaxY(region.geometry) AND idx.ymax >= MbrMinY(region.geometry)
+      AND Contains(region.geometry, PointOnSurface({table}.geometry))
+    """
+    rows = db.execute(sql, {"polygon": json.dumps(polygon)})
+
+    return [row["id"] for row in rows]
+
+
+def get_states_intersecting_mbr(*, db, mbr, exact=False):
+    sql = f"""
+    SELECT
+      cast(state_geojson.STATEFP as INTEGER) as STATEFP,
+      cast(state_geojson.GEOID as INTEGER) as GEOID,
+      state_geojson.NAME,
+      state_geojson.geometry
+    FROM
+      idx_state_shp_geometry AS idx
+      CROSS JOIN state_shp ON state_shp.ROWID = idx.pkid
+      CROSS JOIN state_geojson ON state_geojson.GEOID = state_shp.GEOID
+    WHERE
+      {search_frame_sql("state_shp", exact=exact)}
     """
-    rows = db.execute(sql, mbr).fetchall()
+    rows = db.execute(sql, get_search_frame(mbr)).fetchall()
 
     return {
         "results": [
             {
                 "statefp": row["STATEFP"],
-                "countyfp": row["COUNTYFP"],
-                "county_name": row["county_name"],
-                "state_name": row["state_name"],
                 "geoid": row["GEOID"],
                 "name": row["NAME"],
                 "geometry": json.loads(row["geometry"]),
@@ -0,0 +1,186 @@
+import gzip
+import math
+import sqlite3
+import numpy
+import mapbox_vector_tile
+import shapely.geometry
+import shapely.ops
+from mapbox_vector_tile.encoder import on_invalid_geometry_make_valid
+
+import app.gis.query
+
+EARTH_RADIUS = 6378137.0
+MAX_LATITUDE = 85.0511287798
+EXTENT = 4096
+BUFFER = 64
+
+# Vector tile layers, the zooms each is rendered for, the query returning
+# its features for a bounding box, and the properties kept on each feature.
+LAYERS = {
+    "zcta": {
+        "minzoom": 7,
+        "maxzoom": 14,
+        "features": app.gis.query.get_zctas_intersecting_mbr,
+        "properties": ["zipcode"],
+    },
+    "county": {
+        "minzoom": 3,
+        "maxzoom": 14,
+        "features": app.gis.query.get_counties_intersecting_mbr,
+        "properties": ["statefp", "countyfp", "geoid", "name"],
+    },
+    "state": {
+        "minzoom": 0,
+        "maxzoom": 10,
+        "features": app.gis.query.get_states_intersecting_mbr,
+        "properties": ["statefp", "geoid", "name"],
+    },
+}
+
+
+def to_mercator(lon, lat):
+    lat = numpy.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    x = numpy.radians(lon) * EARTH_RADIUS
+    y = numpy.log(numpy.tan(math.pi / 4 + numpy.radians(lat) / 2)) * EARTH_RADIUS
+    return x, y
+
+
+def to_lonlat(x, y):
+    lon = math.degrees(x / EARTH_RADIUS)
+    lat = math.degrees(2 * math.atan(math.exp(y / EARTH_RADIUS)) - math.pi / 2)
+    return lon, lat
+
+
+def mercator_bounds(z, x, y):
+    size = 2 * math.pi * EARTH_RADIUS / 2**z
+    minx = -math.pi * EARTH_RADIUS + x * size
+    maxy = math.pi * EARTH_RADIUS - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def lonlat_tiles(z, lon1, lat1, lon2, lat2):
+    # Tile columns/rows covering a lon/lat box at zoom z.
+    n = 2**z
+
+    def column(lon):
+        return min(n - 1, max(0, int((lon + 180) / 360 * n)))
+
+    def row(lat):
+        lat = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat)))
+        y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2
+        return min(n - 1, max(0, int(y * n)))
+
+    for x in range(column(min(lon1, lon2)), column(max(lon1, lon2)) + 1):
+        for y in range(row(max(lat1, lat2)), row(min(lat1, lat2)) + 1):
+            yield x, y
+
+
+def render_tile(*, db, layer, z, x, y) -> bytes:
+    config = LAYERS[layer]
+    minx, miny, maxx, maxy = mercator_bounds(z, x, y)
+    margin = (maxx - minx) * BUFFER / EXTENT
+    clip = shapely.geometry.box(
+        minx - margin, miny - margin, maxx + margin, maxy + margin
+    )
+
+    x1, y1 = to_lonlat(minx - margin, miny - margin)
+    x2, y2 = to_lonlat(maxx + margin, maxy + margin)
+    mbr = {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+    # Layers with several geometry resolutions pick theirs from the zoom.
+    if layer in app.gis.query.RESOLUTIONS:
+        rows = config["features"](db=db, mbr=mbr, zoom=z)["results"]
+    else:
+        rows = config["features"](db=db, mbr=mbr)["results"]
+
+    features = []
+    for row in rows:
+        geometry = shapely.ops.transform(
+            to_mercator, shapely.geometry.shape(row["geometry"])
+        )
+        if not geometry.is_valid:
+            geometry = geometry.buffer(0)
+        geometry = geometry.intersection(clip)
+        if geometry.is_empty:
+            continue
+
+        features.append(
+            {
+                "geometry": geometry,
+                "properties": {name: row[name] for name in config["properties"]},
+            }
+        )
+
+    tile = mapbox_vector_tile.encode(
+        [{"name": layer, "features": features}],
+        quantize_bounds=(minx, miny, maxx, maxy),
+        extents=EXTENT,
+        on_invalid_geometry=on_invalid_geometry_make_valid,
+    )
+
+    return gzip.compress(tile, mtime=0)
+
+
+def create_mbtiles(filepath, layer):
+    # One MBTiles file per layer. Tiles are stored gzip-compressed, with the
+    # TMS row numbering the format uses. WAL mode is kept in the file, so
+    # readers never wait on the writer of a newly rendered tile.
+    db = sqlite3.connect(filepath, timeout=30)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        config = LAYERS[layer]
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata "
+                "(name TEXT PRIMARY KEY, value TEXT)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, "
+                "tile_column INTEGER, tile_row INTEGER, tile_data BLOB, "
+                "PRIMARY KEY (zoom_level, tile_column, tile_row))"
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+                [
+                    ("name", layer),
+                    ("format", "pbf"),
+                    ("minzoom", str(config["minzoom"])),
+                    ("maxzoom", str(config["maxzoom"])),
+                ],
+            )
+    finally:
+        db.close()
+
+
+def connect_mbtiles(filepath):
+    # A connection to a file create_mbtiles has set up, kept open across
+    # requests, one request at a time.
+    return sqlite3.connect(filepath, timeout=30, check_same_thread=False)
+
+
+def read_cached_tile(mbtiles, z, x, y):
+    row = mbtiles.execute(
+        "SELECT tile_data FROM tiles "
+        "WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+        (z, x, 2**z - 1 - y),
+    ).fetchone()
+
+    return None if row is None else row[0]
+
+
+def write_cached_tile(mbtiles, z, x, y, data):
+    with mbtiles:
+        mbtiles.execute(
+            "INSERT OR REPLACE INTO tiles "
+            "(zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+            (z, x, 2**z - 1 - y, data),
+        )
+
+
+def get_tile(*, db, mbtiles, layer, z, x, y) -> bytes:
+    data = read_cached_tile(mbtiles, z, x, y)
+
+    if data is None:
+        data = render_tile(db=db, layer=layer, z=z, x=x, y=y)
+        write_cached_tile(mbtiles, z, x, y, data)
+
+    return data
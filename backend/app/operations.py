@@ -1,13 +1,56 @@
+import os
+import numpy
 import pandas
 from typing import Union
 
 from flask import current_app
 import app.useeio.matrices
+import app.useeio.impacts
+import app.gis.geocode
 import app.gis.query
 import app.cbp.query
 import app.cbp.database
+import app.parquet
 from app.db import get_db, get_cbp_db, get_impacts_db
 
+# Columns identifying a geography in the generated impacts tables.
+ZIPCODE_KEYS = ["zipcode"]
+COUNTY_KEYS = ["statefp", "countyfp", "geoid"]
+STATE_KEYS = ["statefp"]
+
+# Impacts tables ranked by each indicator during generate, with the columns
+# identifying a geography in them. Only the industries contributing most to
+# an indicator are kept per geography: RANKING_DEPTH unless generated with a
+# smaller --depth, and the most /top serves.
+RANKINGS = {
+    "zipcode": ZIPCODE_KEYS,
+    "county": ["statefp", "countyfp"],
+    "state_rollup": STATE_KEYS,
+}
+RANKING_DEPTH = 50
+
+# Levels whose geographies are benchmarked nationally: generate totals each
+# geography's indicators and stores their sorted distribution.
+BENCHMARKS = {
+    "zipcode": ZIPCODE_KEYS,
+    "county": ["statefp", "countyfp"],
+}
+
+
+class MissingDistribution(Exception):
+    # The impacts database lacks a level's generated totals or distributions.
+    def __init__(self, level):
+        super().__init__(
+            f"No {level} distributions; run `flask generate distributions`."
+        )
+
+
+naics_impacts = None
+naics_total_impacts = None
+geocode_indexes = None
+census_session = None
+distributions = None
+
 
 def get_sector_crosswalk():
     matrices = app.useeio.matrices.get_matrices()
@@ -26,6 +69,45 @@ def get_direct_impacts_matrix():
     return D
 
 
+def get_total_impacts_matrix() -> Union[pandas.DataFrame, None]:
+    # N: direct and supply-chain impacts per dollar of each sector's output,
+    # present when the workbook provides A or L.
+    matrices = app.useeio.matrices.get_matrices()
+    if "N" not in matrices:
+        return None
+    N = matrices["N"]
+    N.columns = N.columns.str.rstrip("/US")
+    return N
+
+
+def get_naics_total_impacts():
+    # The NAICS impact table built from N instead of D, so total impacts are
+    # gathered and multiplied exactly like direct ones.
+    global naics_total_impacts
+
+    if naics_total_impacts is None:
+        N = get_total_impacts_matrix()
+        if N is None:
+            return None
+        naics_total_impacts = app.useeio.impacts.build_naics_impacts(
+            crosswalk=get_sector_crosswalk(), impacts=N.transpose()
+        )
+
+    return naics_total_impacts
+
+
+def get_naics_impacts():
+    global naics_impacts
+
+    if naics_impacts is None:
+        naics_impacts = app.useeio.impacts.build_naics_impacts(
+            crosswalk=get_sector_crosswalk(),
+            impacts=get_direct_impacts_matrix().transpose(),
+        )
+
+    return naics_impacts
+
+
 def get_all_counties():
     return app.gis.query.get_all_counties(db=get_db())
 
@@ -42,6 +124,48 @@ def get_all_zipcodes():
     return app.gis.query.get_all_zipcodes(db=get_db())
 
 
+def get_geocode_indexes():
+    # Loaded on first use and kept for the life of the worker process.
+    global geocode_indexes
+
+    if geocode_indexes is None:
+        geocode_indexes = app.gis.geocode.load_indexes(db=get_db())
+
+    return geocode_indexes
+
+
+def geocode_points(points) -> list:
+    return app.gis.geocode.geocode(get_geocode_indexes(), points)
+
+
+# The lists the frontend loads on every page view, served as prebuilt payloads.
+INDEXES = {
+    "zipcodes": get_all_zipcodes,
+    "counties": get_all_counties,
+    "states": get_all_states,
+}
+
+
+def get_index(name) -> dict:
+    return {"results": INDEXES[name]().to_dict("records")}
+
+
+def get_census_options() -> dict:
+    # Census API access shared by the use_api paths: one pooled session per
+    # process, with responses cached on disk.
+    global census_session
+
+    if census_session is None:
+        census_session = app.cbp.query.make_session()
+
+    return {
+        "session": census_session,
+        "base_url": current_app.config["CENSUS_BASE_URL"],
+        "api_key": current_app.config["CENSUS_API_KEY"],
+        "cache_dir": current_app.config["CENSUS_CACHE"],
+    }
+
+
 def industries_by_zipcode(*, zipcode) -> Union[pandas.DataFrame, None]:
     def use_database():
         return app.cbp.database.get_industries_by_zipcode(
@@ -50,8 +174,7 @@ def industries_by_zipcode(*, zipcode) -> Union[pandas.DataFrame, None]:
 
     def use_api():
         return app.cbp.query.get_industries_by_zipcode(
-            base_url=current_app.config["CENSUS_BASE_URL"],
-            api_key=current_app.config["CENSUS_API_KEY"],
+            **get_census_options(),
             zipcode=zipcode,
         )
 
@@ -66,8 +189,7 @@ def industries_by_county(*, statefp, countyfp) -> Union[pandas.DataFrame, None]:
 
     def use_api():
         return app.cbp.query.get_industries_by_county(
-            base_url=current_app.config["CENSUS_BASE_URL"],
-            api_key=current_app.config["CENSUS_API_KEY"],
+            **get_census_options(),
             statefp=statefp,
             countyfp=countyfp,
         )
@@ -83,30 +205,101 @@ def industries_by_state(*, statefp) -> Union[pandas.DataFrame, None]:
 
     def use_api():
         return app.cbp.query.get_industries_by_state(
-            base_url=current_app.config["CENSUS_BASE_URL"],
-            api_key=current_app.config["CENSUS_API_KEY"],
+            **get_census_options(),
             statefp=statefp,
         )
 
     return use_database()
 
 
+def all_industries_by_zipcode() -> pandas.DataFrame:
+    zipcodes = get_all_zipcodes()[["zipcode"]]
+    industries = app.cbp.database.get_all_industries_by_zipcode(db=get_cbp_db())
+    industries = industries.rename(columns={"zipcode": "zip"}).merge(
+        zipcodes.assign(zip=zipcodes["zipcode"].astype("int64")), on="zip"
+    )
+    return industries.drop(["zip"], axis=1)
+
+
+def all_industries_by_county() -> pandas.DataFrame:
+    counties = get_all_counties()[["statefp", "countyfp", "geoid"]]
+    industries = app.cbp.database.get_all_industries_by_county(db=get_cbp_db())
+    return industries.merge(counties, on=["statefp", "countyfp"])
+
+
+def all_industries_by_state() -> pandas.DataFrame:
+    states = get_all_states()[["statefp"]]
+    industries = app.cbp.database.get_all_industries_by_state(db=get_cbp_db())
+    return industries.merge(states, on="statefp")
+
+
 def compute_direct_industry_impacts(industries) -> Union[pandas.DataFrame, None]:
     if industries.shape[0] == 0:
         return None
 
-    crosswalk = get_sector_crosswalk()
-    industries = industries.merge(crosswalk, left_on="naics", right_on="NAICS")
-    industries = industries.drop(["NAICS"], axis=1)
-    impacts = get_direct_impacts_matrix().transpose()
-    industries = industries.merge(impacts, left_on="BEA_Detail", right_index=True)
-    grouped = industries.groupby("naics", as_index=False)
+    return app.useeio.impacts.gather_industry_impacts(industries, get_naics_impacts())
 
-    aggregate_default = {x: "first" for x in industries.columns}
-    aggregate_impacts = {x: "mean" for x in impacts.columns}
-    aggregated = grouped.agg(aggregate_default | aggregate_impacts)
 
-    return aggregated
+# Footprint weights: CBP column -> name in the response. Employment is
+# included wherever the industries carry it (county and state, not zipcode).
+FOOTPRINT_WEIGHTS = {"establishments": "establishments", "EMP": "employment"}
+
+
+# Impact tables by scope: direct (D) or direct plus supply chain (N).
+SCOPES = {"direct": get_naics_impacts, "total": get_naics_total_impacts}
+
+
+def get_scope_impacts(scope):
+    naics_impacts = SCOPES[scope]()
+    if naics_impacts is None:
+        raise ValueError(f"The USEEIO matrices have no {scope} impacts.")
+    return naics_impacts
+
+
+def compute_footprint(industries, *, scope="direct") -> dict:
+    # Indicator totals over all of a geography's industries, per weight.
+    weights = [x for x in FOOTPRINT_WEIGHTS if x in industries.columns]
+    naics_impacts = get_scope_impacts(scope)
+    totals = app.useeio.impacts.footprint_totals(
+        industries, naics_impacts, weights=weights
+    )
+    codes = {name: code for code, name in get_indicator_columns().items()}
+    indicators = [codes.get(x, x) for x in naics_impacts["indicators"]]
+
+    return {
+        FOOTPRINT_WEIGHTS[weight]: dict(zip(indicators, totals[i].tolist()))
+        for i, weight in enumerate(weights)
+    }
+
+
+# Every geography of a level, for batched footprints.
+FOOTPRINT_LEVELS = {
+    "zipcode": {"keys": ZIPCODE_KEYS, "industries": all_industries_by_zipcode},
+    "county": {"keys": COUNTY_KEYS, "industries": all_industries_by_county},
+    "state": {"keys": STATE_KEYS, "industries": all_industries_by_state},
+}
+
+
+def compute_all_footprints(level, *, scope="direct") -> pandas.DataFrame:
+    # Establishment footprints of every geography in the level, from one
+    # sparse establishment matrix multiplied through the impacts at once.
+    config = FOOTPRINT_LEVELS[level]
+    naics_impacts = get_scope_impacts(scope)
+    industries = config["industries"]()
+    matrix = app.useeio.impacts.build_establishment_matrix(
+        industries, naics_impacts, keys=config["keys"]
+    )
+    totals = app.useeio.impacts.geography_footprint_totals(matrix, naics_impacts)
+
+    codes = {name: code for code, name in get_indicator_columns().items()}
+    indicators = [codes.get(x, x) for x in naics_impacts["indicators"]]
+    return matrix["geographies"].join(pandas.DataFrame(totals, columns=indicators))
+
+
+def get_impacts_version() -> str:
+    # Changes whenever impacts.sqlite3 is regenerated or replaced.
+    stat = os.stat(current_app.config["IMPACTS_DATABASE"])
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
 
 
 def get_direct_industry_impacts_by_zipcode(*, zipcode) -> Union[pandas.DataFrame, None]:
@@ -133,15 +326,117 @@ def get_direct_industry_impacts_by_county(
     )
 
 
-def get_direct_industry_impacts_by_state(statefp) -> Union[pandas.DataFrame, None]:
+def get_direct_industry_impacts_by_state(
+    statefp, *, breakdown=None
+) -> Union[pandas.DataFrame, None]:
+    # The state's industries rolled up over its counties, or with
+    # breakdown="county" every county's rows.
     current_app.logger.info(f"Getting direct industry impact data for state/{statefp}")
+    table = "county" if breakdown == "county" else "state_rollup"
     return pandas.read_sql(
-        "SELECT * from county where statefp=:statefp",
+        f"SELECT * from {table} where statefp=:statefp",
         get_impacts_db(),
         params={"statefp": statefp},
     )
 
 
+def get_indicator_columns() -> dict:
+    # Indicator code (e.g. "GHG") to the impacts column holding it.
+    indicators = get_indicators_matrix()
+    return dict(zip(indicators["Code"], indicators.index))
+
+
+def get_top_industries(table, *, indicator, limit, **geography) -> pandas.DataFrame:
+    # The impacts rows of a geography's `limit` industries contributing most
+    # to `indicator`, in rank order, read through the ranking built for
+    # `table` during generate.
+    current_app.logger.info(
+        f"Getting top {limit} industries by {indicator} from {table} for {geography}"
+    )
+    keys = RANKINGS[table]
+    where = " AND ".join(f"ranking.{key}=:{key}" for key in keys)
+    join = " AND ".join(f"impacts.{key}=ranking.{key}" for key in keys + ["naics"])
+    return pandas.read_sql(
+        f"SELECT impacts.*, ranking.rank FROM {table}_rank AS ranking "
+        f"CROSS JOIN {table} AS impacts ON {join} "
+        f"WHERE {where} AND ranking.indicator=:indicator AND ranking.rank<=:limit "
+        "ORDER BY ranking.rank",
+        get_impacts_db(),
+        params={"indicator": indicator, "limit": limit, **geography},
+    )
+
+
+def get_distributions() -> dict:
+    # (level, indicator code) -> sorted totals of every geography, loaded once
+    # per process and again whenever impacts.sqlite3 changes.
+    global distributions
+    version = get_impacts_version()
+    if distributions is None or distributions["version"] != version:
+        rows = get_impacts_db().execute(
+            "SELECT level, indicator, totals FROM distribution"
+        )
+        distributions = {
+            "version": version,
+            "totals": {
+                (row["level"], row["indicator"]): numpy.frombuffer(
+                    row["totals"], dtype="<f8"
+                )
+                for row in rows
+            },
+        }
+    return distributions["totals"]
+
+
+def get_percentiles(level, **geography) -> Union[list, None]:
+    # Where a geography's total for each indicator falls among all of the
+    # level's geographies: the percentage with a total no greater than it.
+    keys = BENCHMARKS[level]
+    where = " AND ".join(f"{key}=:{key}" for key in keys)
+    db = get_impacts_db()
+    tables = db.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type='table' AND name IN (?, ?)",
+        (f"{level}_totals", "distribution"),
+    ).fetchone()[0]
+    if tables < 2:
+        raise MissingDistribution(level)
+
+    row = db.execute(f"SELECT * FROM {level}_totals WHERE {where}", geography)
+    row = row.fetchone()
+    if row is None:
+        return None
+
+    results = []
+    totals = get_distributions()
+    for code, name in get_indicator_columns().items():
+        distribution = totals.get((level, code))
+        if distribution is None:
+            raise MissingDistribution(level)
+        rank = numpy.searchsorted(distribution, row[code], side="right")
+        results.append(
+            {
+                "indicator": code,
+                "name": name,
+                "total": row[code],
+                "percentile": 100.0 * rank / distribution.shape[0],
+                "count": distribution.shape[0],
+            }
+        )
+    return results
+
+
+def read_direct_industry_impacts(
+    level, *, statefp=None, countyfp=None, zipcode=None
+) -> pandas.DataFrame:
+    # Reads the parquet export, touching only matching partitions/row groups.
+    return app.parquet.read_dataset(
+        root=current_app.config["IMPACTS_PARQUET"],
+        level=level,
+        statefp=statefp,
+        countyfp=countyfp,
+        zipcode=zipcode,
+    )
+
+
 def compute_direct_industry_impacts_by_zipcode(*, zipcode):
     current_app.logger.info(
         f"Computing direct industry impact data for zipcode/{zipcode}"
@@ -163,3 +458,69 @@ def compute_direct_industry_impacts_by_state(statefp):
         f"Computing direct industry impact data for state/{statefp}"
     )
     return compute_direct_industry_impacts(industries_by_state(statefp=int(statefp)))
+
+
+# Levels a region can be built from: the spatial layer resolving polygons,
+# and the CBP lookup for a list of that level's ids.
+REGION_LEVELS = {
+    "zipcode": {
+        "layer": "zcta",
+        "industries": lambda ids: app.cbp.database.get_industries_by_zipcodes(
+            db=get_cbp_db(), zipcodes=ids
+        ),
+    },
+    "county": {
+        "layer": "county",
+        "industries": lambda ids: app.cbp.database.get_industries_by_counties(
+            db=get_cbp_db(), geoids=ids
+        ),
+    },
+}
+
+
+def get_region_ids(level, *, polygon) -> list:
+    return app.gis.query.get_ids_within_polygon(
+        db=get_db(), layer=REGION_LEVELS[level]["layer"], polygon=polygon
+    )
+
+
+def compute_region_impacts(level, ids) -> Union[pandas.DataFrame, None]:
+    # The region's establishments summed per industry across its geographies,
+    # then joined to the per-industry impacts once.
+    current_app.logger.info(f"Computing impacts for a region of {len(ids)} {level}s")
+    industries = REGION_LEVELS[level]["industries"](ids)
+    industries = industries.groupby("naics", as_index=False, sort=False)[
+        "establishments"
+    ].sum()
+    return compute_direct_industry_impacts(industries)
+
+
+def compute_direct_industry_impacts_for_geographies(
+    industries, *, keys
+) -> pandas.DataFrame:
+    naics_impacts = get_naics_impacts()
+    matrix = app.useeio.impacts.build_establishment_matrix(
+        industries, naics_impacts, keys=keys
+    )
+    return app.useeio.impacts.gather_geography_impacts(matrix, naics_impacts)
+
+
+def compute_all_direct_industry_impacts_by_zipcode() -> pandas.DataFrame:
+    current_app.logger.info("Computing direct industry impact data for all zipcodes")
+    return compute_direct_industry_impacts_for_geographies(
+        all_industries_by_zipcode(), keys=ZIPCODE_KEYS
+    )
+
+
+def compute_all_direct_industry_impacts_by_county() -> pandas.DataFrame:
+    current_app.logger.info("Computing direct industry impact data for all counties")
+    return compute_direct_industry_impacts_for_geographies(
+        all_industries_by_county(), keys=COUNTY_KEYS
+    )
+
+
+def compute_all_direct_industry_impacts_by_state() -> pandas.DataFrame:
+    current_app.logger.info("Computing direct industry impact data for all states")
+    return compute_direct_industry_impacts_for_geographies(
+        all_industries_by_state(), keys=STATE_KEYS
+    )
@@ -0,0 +1,130 @@
+import os
+import shutil
+import pandas
+import pyarrow
+import pyarrow.parquet
+
+# How each impacts table is laid out as a hive-partitioned parquet dataset:
+# the partition column, the ordered key columns of one geography, and the
+# least number of rows in a row group. Row groups never split a geography,
+# so their min/max statistics let readers skip to a single geography.
+LAYOUTS = {
+    "zipcode": {
+        "partition": "zipcode_prefix",
+        "keys": ["zipcode"],
+        "row_group_rows": 5000,
+    },
+    "county": {
+        "partition": "statefp",
+        "keys": ["statefp", "countyfp"],
+        "row_group_rows": 1,
+    },
+    "state": {
+        "partition": "statefp",
+        "keys": ["statefp"],
+        "row_group_rows": 1,
+    },
+}
+
+
+def get_partitions(*, db, level):
+    if level == "zipcode":
+        return [str(x) for x in range(10)]
+
+    rows = db.execute(f'SELECT DISTINCT statefp FROM "{level}" ORDER BY statefp')
+    return [row[0] for row in rows]
+
+
+def read_partition(*, db, level, partition):
+    keys = ", ".join(LAYOUTS[level]["keys"])
+
+    if level == "zipcode":
+        return pandas.read_sql(
+            f"SELECT * FROM zipcode WHERE zipcode >= :start AND zipcode < :end "
+            f"ORDER BY {keys}, naics",
+            db,
+            params={"start": partition, "end": chr(ord(partition) + 1)},
+        )
+
+    return pandas.read_sql(
+        f'SELECT * FROM "{level}" WHERE statefp=:statefp ORDER BY {keys}, naics',
+        db,
+        params={"statefp": partition},
+    )
+
+
+def split_geographies(df, keys):
+    # `df` is ordered by `keys`; the partition column is no longer among them.
+    keys = [x for x in keys if x in df.columns]
+    if not keys:
+        return [df]
+
+    return [group for _, group in df.groupby(keys, sort=False)]
+
+
+def write_partition(df, *, path, layout, schema):
+    os.makedirs(path, exist_ok=True)
+    buffered = []
+    buffered_rows = 0
+
+    with pyarrow.parquet.ParquetWriter(
+        os.path.join(path, "part-0.parquet"), schema
+    ) as writer:
+        for group in split_geographies(df, layout["keys"]):
+            buffered.append(group)
+            buffered_rows += group.shape[0]
+            if buffered_rows >= layout["row_group_rows"]:
+                table = pyarrow.Table.from_pandas(
+                    pandas.concat(buffered), schema=schema, preserve_index=False
+                )
+                writer.write_table(table, row_group_size=table.num_rows)
+                buffered = []
+                buffered_rows = 0
+
+        if buffered:
+            table = pyarrow.Table.from_pandas(
+                pandas.concat(buffered), schema=schema, preserve_index=False
+            )
+            writer.write_table(table, row_group_size=table.num_rows)
+
+
+def export_dataset(*, db, level, root):
+    # Streams one partition at a time from the impacts database into
+    # root/level/partition=value/part-0.parquet, replacing any previous export.
+    layout = LAYOUTS[level]
+    target = os.path.join(root, level)
+    shutil.rmtree(target, ignore_errors=True)
+    schema = None
+
+    for partition in get_partitions(db=db, level=level):
+        df = read_partition(db=db, level=level, partition=partition)
+        if df.shape[0] == 0:
+            continue
+
+        df = df.drop([layout["partition"]], axis=1, errors="ignore")
+        if schema is None:
+            schema = pyarrow.Schema.from_pandas(df, preserve_index=False)
+
+        path = os.path.join(target, f"{layout['partition']}={partition}")
+        write_partition(df, path=path, layout=layout, schema=schema)
+        yield partition, df.shape[0]
+
+
+def read_dataset(*, root, level, statefp=None, countyfp=None, zipcode=None):
+    filters = []
+
+    if statefp is not None:
+        filters.append(("statefp", "=", int(statefp)))
+    if countyfp is not None:
+        filters.append(("countyfp", "=", int(countyfp)))
+    if zipcode is not None:
+        filters.append(("zipcode_prefix", "=", int(str(zipcode)[0])))
+        filters.append(("zipcode", "=", str(zipcode)))
+
+    table = pyarrow.parquet.read_table(
+        os.path.join(root, level),
+        filters=filters or None,
+        partitioning="hive",
+    )
+
+    return table.to_pandas()
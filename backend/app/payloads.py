@@ -0,0 +1,62 @@
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered.
+    brotli = None
+
+# Content codings in order of preference; "identity" is always available.
+ENCODINGS = ["br", "gzip", "identity"]
+
+SUFFIXES = {"identity": ".json", "gzip": ".json.gz", "br": ".json.br"}
+
+
+def compress(body) -> dict:
+    payload = {
+        "etag": hashlib.sha1(body).hexdigest(),
+        "identity": body,
+        "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+    }
+
+    if brotli is not None:
+        payload["br"] = brotli.compress(body, quality=11)
+
+    return payload
+
+
+def write_payload(directory, name, payload):
+    os.makedirs(directory, exist_ok=True)
+
+    for encoding, suffix in SUFFIXES.items():
+        if encoding in payload:
+            with open(os.path.join(directory, name + suffix), "wb") as f:
+                f.write(payload[encoding])
+
+
+def read_payload(directory, name):
+    try:
+        with open(os.path.join(directory, name + SUFFIXES["identity"]), "rb") as f:
+            body = f.read()
+    except FileNotFoundError:
+        return None
+
+    payload = {"etag": hashlib.sha1(body).hexdigest(), "identity": body}
+
+    for encoding in ["br", "gzip"]:
+        try:
+            with open(os.path.join(directory, name + SUFFIXES[encoding]), "rb") as f:
+                payload[encoding] = f.read()
+        except FileNotFoundError:
+            pass
+
+    return payload
+
+
+def select_encoding(payload, accept_encodings) -> str:
+    for encoding in ENCODINGS:
+        if encoding in payload and accept_encodings[encoding]:
+            return encoding
+
+    return "identity"
@@ -0,0 +1,69 @@
+import os
+import threading
+
+
+class ConnectionPool:
+    # Idle connections kept for reuse by later requests in the same process.
+    # `version` identifies the database file the connections were opened on.
+    # Connections inherited across a fork are dropped unused, since SQLite
+    # handles must not be shared between processes.
+    def __init__(self, connect, max_idle, version=None):
+        self.connect = connect
+        self.max_idle = max_idle
+        self.version = version
+        self.idle = []
+        self.pid = os.getpid()
+        self.closed = False
+        self.opened = 0
+        self.reused = 0
+        self.in_use = 0
+        self.lock = threading.Lock()
+
+    def check_fork(self):
+        if self.pid != os.getpid():
+            self.idle = []
+            self.pid = os.getpid()
+            self.opened = 0
+            self.reused = 0
+            self.in_use = 0
+
+    def acquire(self):
+        with self.lock:
+            self.check_fork()
+            self.in_use += 1
+            if self.idle:
+                self.reused += 1
+                return self.idle.pop()
+            self.opened += 1
+
+        return self.connect()
+
+    def release(self, connection):
+        with self.lock:
+            self.check_fork()
+            self.in_use = max(0, self.in_use - 1)
+            if not self.closed and len(self.idle) < self.max_idle:
+                self.idle.append(connection)
+                return
+
+        connection.close()
+
+    def close(self):
+        # Connections still in use are closed when they are released.
+        with self.lock:
+            self.check_fork()
+            self.closed = True
+            idle, self.idle = self.idle, []
+
+        for connection in idle:
+            connection.close()
+
+    def stats(self):
+        with self.lock:
+            self.check_fork()
+            return {
+                "idle": len(self.idle),
+                "in_use": self.in_use,
+                "opened": self.opened,
+                "reused": self.reused,
+            }
@@ -1,11 +1,20 @@
 import click
+import flask
+import hashlib
 import jsonschema
 import json
-from flask import Blueprint, request, current_app
+import numpy
+import os
+import pandas
+import pyarrow
+import pyarrow.compute
+from flask import Blueprint, Response, request, current_app, stream_with_context
+from werkzeug.http import is_resource_modified
 
 import app.operations
 import app.gis.query
-from app.db import get_db
+import app.payloads
+from app.db import get_db, get_pool_stats
 
 
 class InvalidAPIUsage(Exception):
@@ -27,6 +36,20 @@ class InvalidAPIUsage(Exception):
 blueprint = Blueprint("query", __name__, url_prefix="/query")
 
 
+def validate(instance, schema):
+    # Requests that fail their schema are the client's error, not the server's.
+    try:
+        jsonschema.validate(instance=instance, schema=schema)
+    except jsonschema.ValidationError as e:
+        raise InvalidAPIUsage(e.message)
+
+
+SPLIT_MIMETYPE = "application/vnd.zctaimpacts.split+json"
+
+MAX_GEOCODE_POINTS = 50000
+MAX_REGION_IDS = 50000
+
+
 @blueprint.cli.command("indicators")
 def print_indicators():
     print(app.operations.get_indicators_matrix().to_html())
@@ -37,6 +60,16 @@ def serve_indicators():
     return {"indicators": app.operations.get_indicators_matrix().to_dict("records")}
 
 
+@blueprint.route("/stats", methods=["GET"])
+def serve_stats():
+    # Per worker process: pooled database connections and the impacts cache.
+    return {
+        "pid": os.getpid(),
+        "pools": get_pool_stats(),
+        "impacts_cache": current_app.extensions["impacts_cache"].stats(),
+    }
+
+
 @blueprint.cli.command("industries_by_county")
 @click.argument("state", type=int)
 @click.argument("county", type=int)
@@ -112,26 +145,49 @@ def print_all_states():
     print(json.dumps(app.operations.get_all_states().to_dict("records")))
 
 
+def serve_index_payload(name):
+    # Built once per process (or read from `flask generate payloads` output)
+    # and served as precompressed bytes in the best encoding the client takes.
+    payloads = current_app.extensions["index_payloads"]
+    payload = payloads.get(name)
+
+    if payload is None:
+        payload = app.payloads.read_payload(current_app.config["INDEX_PAYLOADS"], name)
+        if payload is None:
+            body = flask.json.dumps(app.operations.get_index(name)).encode()
+            payload = app.payloads.compress(body)
+        payloads[name] = payload
+
+    encoding = app.payloads.select_encoding(payload, request.accept_encodings)
+
+    response = Response(payload[encoding], mimetype="application/json")
+    if encoding != "identity":
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    response.set_etag(f"{payload['etag']}-{encoding}")
+
+    return response.make_conditional(request)
+
+
 @blueprint.route("/zipcode/all", methods=["GET"])
 def serve_get_all_zipcodes():
     current_app.logger.info("Request for all zipcodes.")
-    return {"results": app.operations.get_all_zipcodes().to_dict("records")}
+    return serve_index_payload("zipcodes")
 
 
 @blueprint.route("/county/all", methods=["GET"])
 def serve_get_all_counties():
     current_app.logger.info("Request for all counties.")
-    return {"results": app.operations.get_all_counties().to_dict("records")}
+    return serve_index_payload("counties")
 
 
 @blueprint.route("/state/all", methods=["GET"])
 def serve_get_all_states():
     current_app.logger.info("Request for all states.")
-    return {"results": app.operations.get_all_states().to_dict("records")}
+    return serve_index_payload("states")
 
 
-@blueprint.route("/zcta/mbr", methods=["POST"])
-def zcta():
+def serve_intersecting_mbr(layer, id_type):
     mbr = request.get_json()
     if mbr is None:
         raise InvalidAPIUsage("No JSON body found.")
@@ -143,45 +199,210 @@ def zcta():
             "y1": {"type": "number"},
             "x2": {"type": "number"},
             "y2": {"type": "number"},
+            "zoom": {"type": "number"},
+            "exact": {"type": "boolean"},
+            "known": {"type": "array", "items": {"type": id_type}},
+            "previous": {
+                "type": "object",
+                "properties": {
+                    "x1": {"type": "number"},
+                    "y1": {"type": "number"},
+                    "x2": {"type": "number"},
+                    "y2": {"type": "number"},
+                },
+                "required": ["x1", "y1", "x2", "y2"],
+            },
+            "limit": {"type": "integer", "minimum": 1},
+            "cursor": {"type": "integer", "minimum": 0},
+            "centroids": {"type": "boolean"},
         },
         "required": ["x1", "y1", "x2", "y2"],
     }
 
-    jsonschema.validate(instance=mbr, schema=schema)
+    validate(mbr, schema)
+
+    # Clients that pass the ids they hold, or the box of their last request,
+    # receive only the features they are missing; a box that was answered
+    # with pages or centroids is ignored. Responses hold at most
+    # MBR_FEATURE_LIMIT geometries: page through larger frames with a cursor,
+    # or get centroids for them, MBR_CENTROID_LIMIT per page.
+    max_limit = current_app.config["MBR_FEATURE_LIMIT"]
+    features = app.gis.query.stream_intersecting_mbr(
+        layer,
+        db=get_db(),
+        mbr=mbr,
+        limit=min(mbr.get("limit", max_limit), max_limit),
+        centroid_limit=current_app.config["MBR_CENTROID_LIMIT"],
+        cursor=mbr.get("cursor"),
+        centroids=mbr.get("centroids", False),
+        zoom=mbr.get("zoom"),
+        exact=mbr.get("exact", False),
+        known=mbr.get("known"),
+        previous=mbr.get("previous"),
+    )
+
+    return Response(stream_with_context(features), mimetype="application/geo+json")
 
-    return app.gis.query.get_zctas_intersecting_mbr(db=get_db(), mbr=mbr)
+
+@blueprint.route("/zcta/mbr", methods=["POST"])
+def zcta():
+    return serve_intersecting_mbr("zcta", "string")
 
 
 @blueprint.route("/county/mbr", methods=["POST"])
 def county_mbr():
-    mbr = request.get_json()
-    if mbr is None:
+    return serve_intersecting_mbr("county", "number")
+
+
+@blueprint.cli.command("geocode")
+@click.argument("filepath", type=click.Path(exists=True, dir_okay=False))
+@click.option("--lon", "lon_column", default="lon", show_default=True)
+@click.option("--lat", "lat_column", default="lat", show_default=True)
+def print_geocoded_points(filepath, lon_column, lat_column):
+    points = pandas.read_csv(filepath, usecols=[lon_column, lat_column])
+    results = app.operations.geocode_points(
+        zip(points[lon_column].tolist(), points[lat_column].tolist())
+    )
+    print(pandas.DataFrame(results).convert_dtypes().to_csv(index=False), end="")
+
+
+@blueprint.route("/geocode", methods=["POST"])
+def serve_geocoded_points():
+    # The *_shp polygons are simplified to 2% of their vertices, so points close
+    # to a boundary may land in the neighbouring zipcode, county or state.
+    params = request.get_json()
+    if params is None:
         raise InvalidAPIUsage("No JSON body found.")
 
     schema = {
         "type": "object",
         "properties": {
-            "x1": {"type": "number"},
-            "y1": {"type": "number"},
-            "x2": {"type": "number"},
-            "y2": {"type": "number"},
+            "points": {
+                "type": "array",
+                "maxItems": MAX_GEOCODE_POINTS,
+            },
         },
-        "required": ["x1", "y1", "x2", "y2"],
+        "required": ["points"],
     }
 
-    jsonschema.validate(instance=mbr, schema=schema)
-
-    result = app.gis.query.get_counties_intersecting_mbr(db=get_db(), mbr=mbr)
-
-    return result
-
-
-@blueprint.route("/zipcode/impacts", methods=["POST"])
+    validate(params, schema)
+
+    # Validating each point through jsonschema costs more than geocoding it.
+    try:
+        points = numpy.asarray(params["points"], dtype=float).reshape(-1, 2)
+    except (TypeError, ValueError):
+        raise InvalidAPIUsage("Points must be [lon, lat] pairs of numbers.")
+    if len(points) != len(params["points"]):
+        raise InvalidAPIUsage("Points must be [lon, lat] pairs of numbers.")
+
+    current_app.logger.info(f"Geocoding {len(points)} points.")
+
+    return {"results": app.operations.geocode_points(points.tolist())}
+
+
+def get_request_params(schema):
+    # POST bodies are JSON; GET (cacheable) requests carry the same fields as
+    # query arguments, with numbers parsed according to the schema.
+    if request.method == "GET":
+        params = {}
+        for name, spec in schema["properties"].items():
+            if name not in request.args:
+                continue
+            value = request.args[name]
+            if spec["type"] in ("number", "integer"):
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise InvalidAPIUsage(f"Invalid number for {name}.")
+                value = int(value) if value.is_integer() else value
+            params[name] = value
+    else:
+        params = request.get_json()
+        if params is None:
+            raise InvalidAPIUsage("No JSON body found.")
+
+    validate(params, schema)
+
+    return params
+
+
+def get_response_format():
+    # "records" (the default) is a list of one object per industry; "split"
+    # is {"columns": [...], "data": [[...], ...]}, chosen by ?format=split or
+    # by accepting SPLIT_MIMETYPE.
+    response_format = request.args.get("format")
+
+    if response_format is None:
+        accepted = [value for value, _ in request.accept_mimetypes]
+        response_format = "split" if SPLIT_MIMETYPE in accepted else "records"
+
+    if response_format not in ("records", "split"):
+        raise InvalidAPIUsage(f"Unknown response format {response_format}.")
+
+    return response_format
+
+
+def encode_column(values) -> pyarrow.Array:
+    # A column's values as JSON text. Arrow casts numbers to their shortest
+    # round-tripping decimal in C++, so floats keep full precision; text is
+    # quoted and escaped by json.
+    if values.dtype.kind not in "biuf":
+        values = values.astype(object).where(values.notna(), None)
+        return pyarrow.array(list(map(json.dumps, values.tolist())), pyarrow.string())
+
+    values = values.to_numpy()
+    missing = ~numpy.isfinite(values) if values.dtype.kind == "f" else None
+    encoded = pyarrow.compute.cast(
+        pyarrow.array(values, mask=missing), pyarrow.string()
+    )
+    return pyarrow.compute.fill_null(encoded, "null")
+
+
+def serialize_industries(industries, response_format) -> bytes:
+    if response_format == "split":
+        # Column names once rather than per row, and rows joined column-wise
+        # by Arrow rather than built cell by cell in Python.
+        columns = [encode_column(values) for _, values in industries.items()]
+        rows = pyarrow.compute.binary_join_element_wise(*columns, ",").to_pylist()
+        data = "[[" + "],[".join(rows) + "]]" if rows else "[]"
+        return (
+            f'{{"industries":{{"columns":{json.dumps(list(industries.columns))},'
+            f'"data":{data}}}}}'
+        ).encode()
+
+    return flask.json.dumps({"industries": industries.to_dict("records")}).encode()
+
+
+def serve_cached_impacts(key, compute):
+    # Responses are pure functions of the request and of impacts.sqlite3, so
+    # the serialized body is cached under both and tagged with a strong ETag.
+    # A matching If-None-Match gets its 304 before any body is looked up.
+    key = key + (get_response_format(),)
+    version = app.operations.get_impacts_version()
+    etag = hashlib.sha1(json.dumps([version, key]).encode()).hexdigest()
+
+    if request.method in ("GET", "HEAD") and not is_resource_modified(
+        request.environ, etag=etag
+    ):
+        response = Response(status=304)
+    else:
+        cache = current_app.extensions["impacts_cache"]
+        body = cache.get((version, key))
+        if body is None:
+            body = serialize_industries(compute(), key[-1])
+            cache.put((version, key), body)
+        response = Response(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    response.vary.add("Accept")
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
+@blueprint.route("/zipcode/impacts", methods=["GET", "POST"])
 def serve_direct_industry_impacts_by_zipcode():
-    params = request.get_json()
-    if params is None:
-        raise InvalidAPIUsage("No JSON body found.")
-
     schema = {
         "type": "object",
         "properties": {
@@ -190,29 +411,26 @@ def serve_direct_industry_impacts_by_zipcode():
         "required": ["zipcode"],
     }
 
-    jsonschema.validate(instance=params, schema=schema)
+    params = get_request_params(schema)
 
     current_app.logger.info(
         f"Processing request for impact data for zipcode {params['zipcode']}"
     )
 
-    industries = app.operations.get_direct_industry_impacts_by_zipcode(
-        zipcode=params["zipcode"]
-    )
+    def compute():
+        industries = app.operations.get_direct_industry_impacts_by_zipcode(
+            zipcode=params["zipcode"]
+        )
 
-    current_app.logger.info(f"Computed impact data for zipcode {params['zipcode']}")
+        current_app.logger.info(f"Computed impact data for zipcode {params['zipcode']}")
 
-    return {
-        "industries": industries.to_dict("records"),
-    }
+        return industries
 
+    return serve_cached_impacts(("zipcode", params["zipcode"]), compute)
 
-@blueprint.route("/county/impacts", methods=["POST"])
-def serve_direct_industry_impacts_by_county():
-    params = request.get_json()
-    if params is None:
-        raise InvalidAPIUsage("No JSON body found.")
 
+@blueprint.route("/county/impacts", methods=["GET", "POST"])
+def serve_direct_industry_impacts_by_county():
     schema = {
         "type": "object",
         "properties": {
@@ -222,49 +440,244 @@ def serve_direct_industry_impacts_by_county():
         "required": ["statefp", "countyfp"],
     }
 
-    jsonschema.validate(instance=params, schema=schema)
+    params = get_request_params(schema)
 
     current_app.logger.info(
         f"Processing request for impact data for {params['statefp']} {params['countyfp']}"
     )
 
-    industries = app.operations.get_direct_industry_impacts_by_county(
-        params["statefp"], params["countyfp"]
-    )
+    def compute():
+        industries = app.operations.get_direct_industry_impacts_by_county(
+            params["statefp"], params["countyfp"]
+        )
 
-    current_app.logger.info(
-        f"Computed impact data for {params['statefp']} {params['countyfp']}"
-    )
+        current_app.logger.info(
+            f"Computed impact data for {params['statefp']} {params['countyfp']}"
+        )
 
-    return {
-        "industries": industries.to_dict("records"),
-    }
+        return industries
 
+    return serve_cached_impacts(
+        ("county", params["statefp"], params["countyfp"]), compute
+    )
 
-@blueprint.route("/state/impacts", methods=["POST"])
-def serve_direct_industry_impacts_by_state():
-    params = request.get_json()
-    if params is None:
-        raise InvalidAPIUsage("No JSON body found.")
 
+@blueprint.route("/state/impacts", methods=["GET", "POST"])
+def serve_direct_industry_impacts_by_state():
     schema = {
         "type": "object",
         "properties": {
             "statefp": {"type": "number"},
+            "breakdown": {"type": "string", "enum": ["county"]},
         },
         "required": ["statefp"],
     }
 
-    jsonschema.validate(instance=params, schema=schema)
+    params = get_request_params(schema)
+    breakdown = params.get("breakdown")
 
     current_app.logger.info(
         f"Processing request for impact data for state/{params['statefp']}"
     )
 
-    industries = app.operations.get_direct_industry_impacts_by_state(params["statefp"])
+    def compute():
+        industries = app.operations.get_direct_industry_impacts_by_state(
+            params["statefp"], breakdown=breakdown
+        )
 
-    current_app.logger.info(f"Computed impact data for state/{params['statefp']}")
+        current_app.logger.info(f"Computed impact data for state/{params['statefp']}")
 
-    return {
-        "industries": industries.to_dict("records"),
+        return industries
+
+    return serve_cached_impacts(("state", params["statefp"], breakdown), compute)
+
+
+def serve_top_industries(table, geography):
+    # The `limit` industries contributing most to an indicator in one
+    # geography, given by the `geography` fields, from the generated ranking.
+    schema = {
+        "type": "object",
+        "properties": geography
+        | {
+            "indicator": {
+                "type": "string",
+                "enum": list(app.operations.get_indicator_columns()),
+            },
+            "limit": {
+                "type": "integer",
+                "minimum": 1,
+                "maximum": app.operations.RANKING_DEPTH,
+            },
+        },
+        "required": list(geography) + ["indicator"],
     }
+
+    params = get_request_params(schema)
+    limit = params.get("limit", 10)
+    values = {name: params[name] for name in geography}
+
+    def compute():
+        return app.operations.get_top_industries(
+            table, indicator=params["indicator"], limit=limit, **values
+        )
+
+    key = ("top", table, *values.values(), params["indicator"], limit)
+    return serve_cached_impacts(key, compute)
+
+
+@blueprint.route("/zipcode/top", methods=["GET", "POST"])
+def serve_top_industries_by_zipcode():
+    return serve_top_industries("zipcode", {"zipcode": {"type": "string"}})
+
+
+@blueprint.route("/county/top", methods=["GET", "POST"])
+def serve_top_industries_by_county():
+    return serve_top_industries(
+        "county", {"statefp": {"type": "number"}, "countyfp": {"type": "number"}}
+    )
+
+
+@blueprint.route("/state/top", methods=["GET", "POST"])
+def serve_top_industries_by_state():
+    return serve_top_industries("state_rollup", {"statefp": {"type": "number"}})
+
+
+def serve_percentiles(level, geography):
+    schema = {
+        "type": "object",
+        "properties": geography,
+        "required": list(geography),
+    }
+
+    params = get_request_params(schema)
+    try:
+        percentiles = app.operations.get_percentiles(level, **params)
+    except app.operations.MissingDistribution as e:
+        raise InvalidAPIUsage(str(e), 503)
+    if percentiles is None:
+        raise InvalidAPIUsage(f"No impacts found for {level} {params}.", 404)
+
+    return {"percentiles": percentiles}
+
+
+@blueprint.route("/zipcode/percentiles", methods=["GET", "POST"])
+def serve_percentiles_by_zipcode():
+    return serve_percentiles("zipcode", {"zipcode": {"type": "string"}})
+
+
+@blueprint.route("/county/percentiles", methods=["GET", "POST"])
+def serve_percentiles_by_county():
+    return serve_percentiles(
+        "county", {"statefp": {"type": "number"}, "countyfp": {"type": "number"}}
+    )
+
+
+@blueprint.cli.command("footprints")
+@click.argument("level", type=click.Choice(list(app.operations.FOOTPRINT_LEVELS)))
+@click.option("--scope", type=click.Choice(["direct", "total"]), default="direct")
+def print_footprints(level, scope):
+    footprints = app.operations.compute_all_footprints(level, scope=scope)
+    print(footprints.to_csv(index=False), end="")
+
+
+def serve_footprint(geography, industries):
+    # Indicator totals for one geography; scope "total" adds the supply-chain
+    # impacts from the Leontief inverse to the direct ones.
+    schema = {
+        "type": "object",
+        "properties": geography
+        | {"scope": {"type": "string", "enum": ["direct", "total"]}},
+        "required": list(geography),
+    }
+
+    params = get_request_params(schema)
+    industries = industries(params)
+    if industries is None or industries.shape[0] == 0:
+        raise InvalidAPIUsage(f"No industries found for {params}.", 404)
+
+    try:
+        footprint = app.operations.compute_footprint(
+            industries, scope=params.get("scope", "direct")
+        )
+    except ValueError as e:
+        raise InvalidAPIUsage(str(e))
+
+    return {"footprint": footprint}
+
+
+@blueprint.route("/zipcode/footprint", methods=["GET", "POST"])
+def serve_footprint_by_zipcode():
+    return serve_footprint(
+        {"zipcode": {"type": "string"}},
+        lambda params: app.operations.industries_by_zipcode(zipcode=params["zipcode"]),
+    )
+
+
+@blueprint.route("/county/footprint", methods=["GET", "POST"])
+def serve_footprint_by_county():
+    return serve_footprint(
+        {"statefp": {"type": "number"}, "countyfp": {"type": "number"}},
+        lambda params: app.operations.industries_by_county(
+            statefp=int(params["statefp"]), countyfp=int(params["countyfp"])
+        ),
+    )
+
+
+@blueprint.route("/state/footprint", methods=["GET", "POST"])
+def serve_footprint_by_state():
+    return serve_footprint(
+        {"statefp": {"type": "number"}},
+        lambda params: app.operations.industries_by_state(
+            statefp=int(params["statefp"])
+        ),
+    )
+
+
+@blueprint.route("/region/impacts", methods=["POST"])
+def serve_direct_industry_impacts_by_region():
+    schema = {
+        "type": "object",
+        "properties": {
+            "level": {"type": "string", "enum": ["zipcode", "county"]},
+            "ids": {
+                "type": "array",
+                "items": {"type": ["string", "number"]},
+                "maxItems": MAX_REGION_IDS,
+            },
+            "polygon": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string", "enum": ["Polygon", "MultiPolygon"]},
+                    "coordinates": {"type": "array"},
+                },
+                "required": ["type", "coordinates"],
+            },
+        },
+        "required": ["level"],
+        "oneOf": [{"required": ["ids"]}, {"required": ["polygon"]}],
+    }
+
+    params = get_request_params(schema)
+    level = params["level"]
+
+    # A region is either listed explicitly or drawn as a polygon, which takes
+    # in every geography whose interior point it contains.
+    if "ids" in params:
+        try:
+            ids = sorted({int(x) for x in params["ids"]})
+        except ValueError:
+            raise InvalidAPIUsage("Ids must be numeric zipcodes or county GEOIDs.")
+    else:
+        ids = sorted(
+            int(x)
+            for x in app.operations.get_region_ids(level, polygon=params["polygon"])
+        )
+
+    current_app.logger.info(f"Processing request for a region of {len(ids)} {level}s")
+
+    def compute():
+        industries = app.operations.compute_region_impacts(level, ids)
+        return industries if industries is not None else pandas.DataFrame()
+
+    digest = hashlib.sha1(json.dumps(ids).encode()).hexdigest()
+    return serve_cached_impacts(("region", level, digest), compute)
@@ -0,0 +1,37 @@
+import gzip
+from flask import Blueprint, Response, abort, current_app, request
+
+import app.gis.tiles
+from app.db import get_db, get_tiles_db
+
+blueprint = Blueprint("tiles", __name__, url_prefix="/tiles")
+
+
+@blueprint.route("/<layer>/<int:z>/<int:x>/<int:y>.mvt", methods=["GET"])
+def serve_tile(layer, z, x, y):
+    config = app.gis.tiles.LAYERS.get(layer)
+    if config is None or not config["minzoom"] <= z <= config["maxzoom"]:
+        abort(404)
+    if not (0 <= x < 2**z and 0 <= y < 2**z):
+        abort(404)
+
+    current_app.logger.info(f"Request for {layer} tile {z}/{x}/{y}")
+
+    data = app.gis.tiles.get_tile(
+        db=get_db(), mbtiles=get_tiles_db(layer), layer=layer, z=z, x=x, y=y
+    )
+
+    # Tiles are stored gzipped; only the rare client without gzip pays for
+    # decompression.
+    response = Response(mimetype="application/vnd.mapbox-vector-tile")
+    if request.accept_encodings["gzip"]:
+        response.set_data(data)
+        response.content_encoding = "gzip"
+    else:
+        response.set_data(gzip.decompress(data))
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    response.add_etag()
+
+    return response.make_conditional(request)
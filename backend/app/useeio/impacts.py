@@ -0,0 +1,180 @@
+import numpy
+import pandas
+
+
+def naics_codes(values) -> numpy.ndarray:
+    # Non-numeric NAICS (e.g. "------" or "11----") become -1, which never matches.
+    values = numpy.asarray(values)
+    if values.dtype.kind in "iu":
+        return values.astype("int64")
+
+    return numpy.fromiter(
+        (int(x) if str(x).isdigit() else -1 for x in values),
+        dtype="int64",
+        count=values.shape[0],
+    )
+
+
+def build_naics_impacts(*, crosswalk, impacts) -> dict:
+    # One row per NAICS code: the first crosswalk entry that has a sector in
+    # `impacts` (sectors x indicators), and the impacts averaged across all
+    # of its BEA_Detail sectors. Rows are ordered by integer NAICS code, and
+    # the table carries blank naics/establishments columns that a gather fills.
+    merged = crosswalk.merge(impacts, left_on="BEA_Detail", right_index=True)
+    merged.insert(0, "naics_code", naics_codes(merged["NAICS"]))
+    merged = merged[merged["naics_code"] >= 0]
+    merged = merged.drop(["NAICS"], axis=1)
+
+    aggregate_default = {x: "first" for x in merged.columns if x != "naics_code"}
+    aggregate_impacts = {x: "mean" for x in impacts.columns}
+    table = merged.groupby("naics_code", sort=True).agg(
+        aggregate_default | aggregate_impacts
+    )
+    codes = table.index.to_numpy(dtype="int64")
+
+    table = table.reset_index(drop=True)
+    table.insert(0, "naics", "")
+    table.insert(1, "establishments", 0)
+
+    # copy() consolidates the per-column blocks left by agg, so a gather is
+    # one take per dtype rather than one per column. `matrix` holds the same
+    # impacts as a dense (NAICS x indicators) array for footprint products.
+    return {
+        "codes": codes,
+        "table": table.copy(),
+        "indicators": list(impacts.columns),
+        "matrix": table[list(impacts.columns)].to_numpy(dtype="float64"),
+    }
+
+
+def naics_positions(codes, naics_impacts):
+    # Row of each code in the NAICS impact table, and which codes have one.
+    known = naics_impacts["codes"]
+    positions = numpy.searchsorted(known, codes)
+    matched = positions < known.shape[0]
+    matched[matched] = known[positions[matched]] == codes[matched]
+    return positions, matched
+
+
+def gather_industry_impacts(industries, naics_impacts) -> pandas.DataFrame:
+    # Equivalent to merging `industries` (naics, establishments) with the
+    # crosswalk and D, then grouping by naics, as a single row gather.
+    naics = industries["naics"].to_numpy()
+    codes = naics_codes(naics)
+
+    # Sorted unique codes, each with the row where it first appears.
+    codes, rows = numpy.unique(codes, return_index=True)
+
+    positions, matched = naics_positions(codes, naics_impacts)
+    rows = rows[matched]
+
+    result = naics_impacts["table"].take(positions[matched])
+    result["naics"] = naics[rows]
+    result["establishments"] = industries["establishments"].to_numpy()[rows]
+    result.index = pandas.RangeIndex(rows.shape[0])
+
+    return result
+
+
+def footprint_totals(industries, naics_impacts, *, weights) -> numpy.ndarray:
+    # Indicator totals over all of `industries`, one row per column named in
+    # `weights` (e.g. establishments): each weight placed in a dense vector
+    # over the NAICS impact table and multiplied through its matrix at once.
+    # Repeated NAICS keep their first row, as in gather_industry_impacts.
+    codes, rows = numpy.unique(
+        naics_codes(industries["naics"].to_numpy()), return_index=True
+    )
+    positions, matched = naics_positions(codes, naics_impacts)
+
+    vectors = numpy.zeros((len(weights), naics_impacts["codes"].shape[0]))
+    values = industries[weights].to_numpy(dtype="float64")
+    vectors[:, positions[matched]] = values[rows[matched]].T
+
+    return vectors @ naics_impacts["matrix"]
+
+
+def build_establishment_matrix(industries, naics_impacts, *, keys) -> dict:
+    # Sparse geography x NAICS establishment matrix in coordinate form, built
+    # from CBP rows for many geographies identified by the `keys` columns.
+    # Columns index the NAICS impact table; NAICS codes without impacts are
+    # dropped, and repeated (geography, naics) pairs keep their first row.
+    naics = industries["naics"].to_numpy()
+    positions, matched = naics_positions(naics_codes(naics), naics_impacts)
+
+    row = industries.groupby(keys, sort=True).ngroup().to_numpy()
+    geographies = industries[keys].drop_duplicates().sort_values(keys)
+
+    entries = numpy.flatnonzero(matched)
+    entries = entries[numpy.lexsort((positions[entries], row[entries]))]
+    first = numpy.ones(entries.shape[0], dtype="bool")
+    first[1:] = (row[entries][1:] != row[entries][:-1]) | (
+        positions[entries][1:] != positions[entries][:-1]
+    )
+    entries = entries[first]
+
+    return {
+        "geographies": geographies.reset_index(drop=True),
+        "shape": (geographies.shape[0], naics_impacts["codes"].shape[0]),
+        "row": row[entries],
+        "col": positions[entries],
+        "naics": naics[entries],
+        "establishments": industries["establishments"].to_numpy()[entries],
+    }
+
+
+def geography_footprint_totals(matrix, naics_impacts) -> numpy.ndarray:
+    # footprint_totals by establishments for every geography in `matrix` at
+    # once: (geographies x indicators), accumulated one indicator at a time
+    # so memory stays proportional to the matrix's entries.
+    weights = matrix["establishments"].astype("float64")
+    impacts = naics_impacts["matrix"][matrix["col"]]
+    geographies = matrix["shape"][0]
+
+    return numpy.column_stack(
+        [
+            numpy.bincount(
+                matrix["row"], weights=weights * impacts[:, i], minlength=geographies
+            )
+            for i in range(impacts.shape[1])
+        ]
+    )
+
+
+def gather_geography_impacts(matrix, naics_impacts) -> pandas.DataFrame:
+    # The per-geography result of gather_industry_impacts for every geography
+    # in `matrix`, stacked, with the geography key columns appended.
+    result = naics_impacts["table"].take(matrix["col"])
+    result["naics"] = matrix["naics"]
+    result["establishments"] = matrix["establishments"]
+
+    geographies = matrix["geographies"]
+    for key in geographies.columns:
+        result[key] = geographies[key].to_numpy()[matrix["row"]]
+
+    result.index = pandas.RangeIndex(matrix["row"].shape[0])
+
+    return result
+
+
+def rollup_impacts(impacts, *, keys, weight="establishments") -> pandas.DataFrame:
+    # One row per (keys, naics) from finer-grained geography rows: `weight`
+    # summed, float (impact) columns averaged weighted by it, and the other
+    # columns taken from the first row. Columns not in `keys` that identify
+    # the finer geography should be dropped by the caller.
+    by = keys + ["naics"]
+    values = [
+        x for x in impacts.select_dtypes("floating").columns if x not in by + [weight]
+    ]
+    others = [x for x in impacts.columns if x not in by + values + [weight]]
+
+    weighted = impacts[values].multiply(impacts[weight], axis=0)
+    weighted[by] = impacts[by]
+    weighted[weight] = impacts[weight]
+
+    sums = weighted.groupby(by, sort=True).sum()
+    sums[values] = sums[values].divide(sums[weight], axis=0)
+
+    result = impacts.groupby(by, sort=True)[others].first().join(sums)
+    result = result.reset_index()
+
+    return result[[x for x in impacts.columns if x in result.columns]]
@@ -1,21 +1,168 @@
+import json
+import os
+import shutil
+import numpy
 import pandas
-import importlib.resources as pkg_resources
+from typing import Union
+
+from . import resources
+
+# Bump whenever the layout of the compiled artifact changes.
+ARTIFACT_VERSION = 2
+
+WORKBOOK = "USEEIOv2.0.xlsx"
+ARTIFACT = "USEEIOv2.0.compiled"
+
+TABLES = ["SectorCrosswalk", "indicators"]
+
+# Model matrices stored as memory-mappable arrays. Only D is required; the
+# rest are read when the workbook has them, and L and N derived otherwise:
+# A (direct requirements), B (flows per dollar), L = (I - A)^-1 (total
+# requirements) and N = D L (total indicator impacts per dollar of demand).
+MATRICES = ["D", "A", "B", "L", "N"]
 
 matrices = None
 
 
+def get_workbook_path() -> str:
+    return os.path.join(os.path.dirname(resources.__file__), WORKBOOK)
+
+
+def get_artifact_path() -> str:
+    return os.path.join(os.path.dirname(resources.__file__), ARTIFACT)
+
+
+def load_workbook(filepath) -> dict:
+    with pandas.ExcelFile(filepath) as xls:
+        loaded = {
+            "SectorCrosswalk": pandas.read_excel(xls, "SectorCrosswalk", header=0),
+            "indicators": pandas.read_excel(xls, "indicators", header=0, index_col=0),
+        }
+        for name in MATRICES:
+            if name == "D" or name in xls.sheet_names:
+                loaded[name] = pandas.read_excel(xls, name, header=0, index_col=0)
+
+    return derive_totals(loaded)
+
+
+def derive_totals(loaded) -> dict:
+    # The Leontief inverse is factored here, once, rather than per request.
+    if "L" not in loaded and "A" in loaded:
+        A = loaded["A"]
+        identity = numpy.identity(A.shape[0])
+        loaded["L"] = pandas.DataFrame(
+            numpy.linalg.solve(identity - A.to_numpy(dtype="float64"), identity),
+            index=A.index,
+            columns=A.columns,
+        )
+
+    if "N" not in loaded and "L" in loaded:
+        D, L = loaded["D"], loaded["L"]
+        loaded["N"] = pandas.DataFrame(
+            D[L.index].to_numpy(dtype="float64") @ L.to_numpy(dtype="float64"),
+            index=D.index,
+            columns=L.columns,
+        )
+
+    return loaded
+
+
+def source_fingerprint(filepath) -> Union[dict, None]:
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def compile_matrices(*, source=None, target=None) -> str:
+    # Matrices are stored as raw .npy files so they can be memory-mapped;
+    # the small tables are pickled. The directory is staged and renamed into
+    # place.
+    source = source or get_workbook_path()
+    target = target or get_artifact_path()
+
+    loaded = load_workbook(source)
+
+    staging = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    index = {
+        "version": ARTIFACT_VERSION,
+        "source": source_fingerprint(source),
+        "matrices": {},
+    }
+
+    for name in MATRICES:
+        if name not in loaded:
+            continue
+        matrix = loaded[name]
+        numpy.save(
+            os.path.join(staging, f"{name}.npy"),
+            numpy.ascontiguousarray(matrix.to_numpy(dtype="float64")),
+        )
+        index["matrices"][name] = {
+            "index": [str(x) for x in matrix.index],
+            "index_name": matrix.index.name,
+            "columns": [str(x) for x in matrix.columns],
+        }
+
+    for name in TABLES:
+        loaded[name].to_pickle(os.path.join(staging, f"{name}.pkl"))
+
+    with open(os.path.join(staging, "index.json"), "w") as f:
+        json.dump(index, f)
+
+    previous = f"{target}.old-{os.getpid()}"
+    if os.path.exists(target):
+        os.rename(target, previous)
+    os.rename(staging, target)
+    shutil.rmtree(previous, ignore_errors=True)
+
+    return target
+
+
+def load_compiled(*, target, source) -> Union[dict, None]:
+    # A missing workbook is not stale: deployments may ship the artifact alone.
+    try:
+        with open(os.path.join(target, "index.json")) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if index.get("version") != ARTIFACT_VERSION:
+        return None
+
+    fingerprint = source_fingerprint(source)
+    if fingerprint is not None and fingerprint != index.get("source"):
+        return None
+
+    compiled = {}
+    for name, labels in index["matrices"].items():
+        values = numpy.load(os.path.join(target, f"{name}.npy"), mmap_mode="r")
+        compiled[name] = pandas.DataFrame(
+            values,
+            index=pandas.Index(labels["index"], name=labels["index_name"]),
+            columns=pandas.Index(labels["columns"]),
+            copy=False,
+        )
+
+    for name in TABLES:
+        compiled[name] = pandas.read_pickle(os.path.join(target, f"{name}.pkl"))
+
+    return compiled
+
+
 def load_matrices() -> dict:
-    from . import resources
-
-    with pkg_resources.path(resources, "USEEIOv2.0.xlsx") as filepath:
-        with pandas.ExcelFile(filepath) as xls:
-            return {
-                "D": pandas.read_excel(xls, "D", header=0, index_col=0),
-                "SectorCrosswalk": pandas.read_excel(xls, "SectorCrosswalk", header=0),
-                "indicators": pandas.read_excel(
-                    xls, "indicators", header=0, index_col=0
-                ),
-            }
+    source = get_workbook_path()
+    compiled = load_compiled(target=get_artifact_path(), source=source)
+
+    if compiled is not None:
+        return compiled
+
+    return load_workbook(source)
 
 
 def get_matrices() -> dict:
@@ -0,0 +1,85 @@
+import random
+import statistics
+import sys
+import time
+
+import app
+import app.gis.query
+from app.db import get_db
+
+# Times the MBR lookup against the configured spatialite database, first with
+# the original full-scan MBRIntersects query and then with the R*Tree-driven
+# query, over the same random viewports across the contiguous US.
+SCAN_SQL = """
+SELECT
+  zcta_geojson.ZCTA5CE20,
+  zcta_geojson.geometry
+FROM
+  zcta_geojson
+  INNER JOIN (
+    SELECT
+      ZCTA5CE20
+    FROM
+      zcta_shp
+    WHERE
+      MBRIntersects(BuildMBR(:x1,:y1,:x2,:y2, 4326), "geometry")
+  ) AS zcta_shp ON zcta_geojson.ZCTA5CE20 = zcta_shp.ZCTA5CE20
+"""
+
+
+def viewports(count, size):
+    rng = random.Random(0)
+    for _ in range(count):
+        x1 = rng.uniform(-124, -67 - size)
+        y1 = rng.uniform(25, 49 - size)
+        yield {"x1": x1, "y1": y1, "x2": x1 + size, "y2": y1 + size}
+
+
+def timed(query, mbrs):
+    timings = []
+    features = 0
+    for mbr in mbrs:
+        start = time.perf_counter()
+        features += len(query(mbr))
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95)], 2),
+        "features": features,
+    }
+
+
+def main(count=50):
+    # Every query is timed to a raw fetchall of its rows, so the R*Tree
+    # timings leave out the GeoJSON decoding the scan does not do either.
+    rtree_sql = app.gis.query.intersecting_mbr_sql("zcta")
+    exact_sql = app.gis.query.intersecting_mbr_sql("zcta", exact=True)
+
+    a = app.create_app()
+    with a.app_context():
+        db = get_db()
+        for size in [0.1, 0.5, 2.0]:
+            mbrs = list(viewports(count, size))
+            scan = timed(lambda mbr: db.execute(SCAN_SQL, mbr).fetchall(), mbrs)
+            rtree = timed(
+                lambda mbr: db.execute(
+                    rtree_sql, app.gis.query.get_query_params(mbr)
+                ).fetchall(),
+                mbrs,
+            )
+            exact = timed(
+                lambda mbr: db.execute(
+                    exact_sql, app.gis.query.get_query_params(mbr)
+                ).fetchall(),
+                mbrs,
+            )
+            print(f"{size} degree viewports:")
+            print(f"  scan  {scan}")
+            print(f"  rtree {rtree}")
+            print(f"  exact {exact}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+from unittest import mock
+import pandas
+
+import app
+import app.cbp.database
+import app.generate
+import app.operations
+import app.useeio.matrices
+
+SECTORS = ["111110/US", "111120/US", "111130/US"]
+
+
+def make_matrices(A=None) -> dict:
+    # A three-sector model with two indicators; with A, the total impacts are
+    # derived from it as compile_matrices does.
+    D = pandas.DataFrame(
+        [[1.5, 2.5, 3.5], [4.5, 5.5, 6.5]],
+        index=pandas.Index(["Greenhouse Gases", "Energy Use"], name="Indicator"),
+        columns=SECTORS,
+    )
+    crosswalk = pandas.DataFrame(
+        {
+            "NAICS": ["111110", "111120", "111130"],
+            "BEA_Sector": ["11", "11", "11"],
+            "BEA_Summary": ["111CA", "111CA", "111CA"],
+            "BEA_Detail": ["111110", "111120", "111130"],
+        }
+    )
+    indicators = pandas.DataFrame(
+        {
+            "Name": ["Greenhouse Gases", "Energy Use"],
+            "Code": ["GHG", "ENRG"],
+            "Unit": ["kg", "MJ"],
+        }
+    ).set_index("Name")
+
+    matrices = {"D": D, "SectorCrosswalk": crosswalk, "indicators": indicators}
+    if A is not None:
+        matrices["A"] = A
+
+    return app.useeio.matrices.derive_totals(matrices)
+
+
+def install_matrices(matrices):
+    # Replaces the loaded USEEIO model and everything operations built from it.
+    app.useeio.matrices.matrices = matrices
+    app.operations.naics_impacts = None
+    app.operations.naics_total_impacts = None
+    app.operations.distributions = None
+
+
+# CBP rows as utils/cbp loads them: (fipstate, fipscty, naics, emp, est) for
+# counties and (zip, name, naics, est) for zipcodes.
+COUNTIES = [
+    (1, 1, "111110", 10, 2),
+    (1, 1, "111120", 20, 4),
+    (1, 3, "111110", 30, 1),
+    (1, 3, "111130", 40, 8),
+    (1, 5, "111120", 50, 3),
+    (2, 1, "111130", 60, 5),
+]
+ZIPCODES = [
+    (1001, "One", "111110", 2),
+    (1001, "One", "111120", 1),
+    (1002, "Two", "111110", 3),
+    (1002, "Two", "111130", 6),
+]
+
+
+def write_cbp(filepath):
+    state = pandas.DataFrame(COUNTIES, columns=["s", "c", "naics", "emp", "est"])
+    state = state.groupby(["s", "naics"], as_index=False)[["emp", "est"]].sum()
+    rows = {
+        "county": COUNTIES,
+        "state": list(state.itertuples(index=False, name=None)),
+        "zipcode": ZIPCODES,
+    }
+
+    con = sqlite3.connect(filepath)
+    with con:
+        for table in app.cbp.database.SCHEMA:
+            app.cbp.database.create_table(con, table)
+            app.cbp.database.insert_rows(con, table, rows[table])
+            app.cbp.database.create_index(con, table)
+    con.close()
+
+
+def county_industries() -> pandas.DataFrame:
+    # The CBP county rows as all_industries_by_county returns them.
+    df = pandas.DataFrame(
+        COUNTIES, columns=["statefp", "countyfp", "naics", "EMP", "establishments"]
+    )
+    df["geoid"] = df["statefp"] * 1000 + df["countyfp"]
+    return df.drop(["EMP"], axis=1)
+
+
+def zipcode_industries() -> pandas.DataFrame:
+    df = pandas.DataFrame(ZIPCODES, columns=["zipcode", "name", "naics", "est"])
+    df = df.rename(columns={"est": "establishments"}).drop(["name"], axis=1)
+    return df.assign(zipcode=df["zipcode"].map("{:05d}".format))
+
+
+def generate(application, level, industries, **options):
+    # Runs `flask generate` for a level on the given CBP rows, which otherwise
+    # come from the spatial database's list of geographies.
+    options = {
+        "database": application.config["IMPACTS_DATABASE"],
+        "workers": 1,
+        "batch_size": 2,
+        "ranking_depth": app.operations.RANKING_DEPTH,
+        "restart": False,
+    } | options
+
+    with application.app_context():
+        with mock.patch.dict(
+            app.generate.LEVELS[level], {"industries": lambda: industries}
+        ):
+            app.generate.generate_level(level, **options)
+
+
+def make_app(directory, **config):
+    return app.create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join(directory, "db.spatialite"),
+            "CBP_DATABASE": os.path.join(directory, "cbp.sqlite3"),
+            "IMPACTS_DATABASE": os.path.join(directory, "impacts.sqlite3"),
+            "IMPACTS_PARQUET": os.path.join(directory, "impacts.parquet"),
+            "INDEX_PAYLOADS": os.path.join(directory, "payloads"),
+            "TILES_CACHE": os.path.join(directory, "tiles"),
+            "CENSUS_CACHE": os.path.join(directory, "census"),
+            "CENSUS_BASE_URL": "http://127.0.0.1:9/",
+            "CENSUS_API_KEY": "test",
+        }
+        | config
+    )
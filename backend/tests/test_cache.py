@@ -0,0 +1,55 @@
+import unittest
+
+from app.cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_evicts_least_recently_used_entry(self):
+        cache = ResponseCache(max_entries=2, max_bytes=100)
+        cache.put("a", b"1")
+        cache.put("b", b"2")
+        cache.get("a")
+        cache.put("c", b"3")
+
+        self.assertEqual(cache.get("a"), b"1")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), b"3")
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_evicts_by_size(self):
+        cache = ResponseCache(max_entries=10, max_bytes=10)
+        cache.put("a", b"1234")
+        cache.put("b", b"1234")
+        cache.put("c", b"1234")
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), b"1234")
+        self.assertEqual(cache.stats()["bytes"], 8)
+
+        # A replaced entry only counts its new body.
+        cache.put("b", b"12345678")
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.stats()["bytes"], 8)
+
+    def test_skips_oversized_body(self):
+        cache = ResponseCache(max_entries=10, max_bytes=4)
+        cache.put("a", b"1234")
+        cache.put("b", b"12345")
+
+        self.assertEqual(cache.get("a"), b"1234")
+        self.assertIsNone(cache.get("b"))
+
+    def test_stats(self):
+        cache = ResponseCache(max_entries=10, max_bytes=100)
+        cache.put("a", b"1")
+        cache.get("a")
+        cache.get("b")
+        cache.clear()
+
+        self.assertEqual(
+            cache.stats(), {"entries": 0, "bytes": 0, "hits": 1, "misses": 1}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import importlib.util
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# The standalone loader in utils/cbp, whose package is also named `app`.
+spec = importlib.util.spec_from_file_location(
+    "cbp_loader",
+    os.path.join(os.path.dirname(__file__), "../utils/cbp/app/__main__.py"),
+)
+loader = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(loader)
+
+# Excerpts in the layout of the CBP 2019 files, with the rollup NAICS rows
+# ("------", "11----", "1133//") that the loader drops.
+FILES = {
+    "cbp19co.txt": """\
+"fipstate","fipscty","naics","emp_nf","emp","est"
+"01","001","------","G","10000","900"
+"01","001","11----","G","50","5"
+"01","001","113310","G","30","3"
+"01","001","1133//","G","30","3"
+"01","003","113310","H","0","2"
+"02","013","221111","G","12","1"
+""",
+    "cbp19st.txt": """\
+"fipstate","naics","lfo","emp","est"
+"01","113310","-","300","30"
+"01","113310","C","200","20"
+"01","113310","Z","100","10"
+"01","11----","-","500","50"
+""",
+    "zbp19detail.txt": """\
+"zip","name","naics","est"
+"01001","AGAWAM, MA","------","400"
+"01001","AGAWAM, MA","113310","3"
+"99950","KETCHIKAN, AK","221111","1"
+""",
+}
+
+
+class TestCbpFiles(unittest.TestCase):
+    def setUp(self):
+        self.raw = tempfile.TemporaryDirectory()
+        for filename, content in FILES.items():
+            with open(os.path.join(self.raw.name, filename), "w") as f:
+                f.write(content)
+        self.db = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.db.close()
+        self.raw.cleanup()
+
+    def load(self, table):
+        # Chunks of two rows, so filtering happens across chunk boundaries.
+        return loader.load(self.db, table, raw=self.raw.name, chunksize=2)
+
+    def test_county(self):
+        self.assertEqual(self.load("county"), 3)
+        self.assertEqual(
+            self.db.execute(
+                "SELECT * FROM county ORDER BY fipstate, fipscty"
+            ).fetchall(),
+            [(1, 1, "113310", 30, 3), (1, 3, "113310", 0, 2), (2, 13, "221111", 12, 1)],
+        )
+        self.assertEqual(
+            self.db.execute(
+                "SELECT DISTINCT typeof(fipstate), typeof(fipscty), typeof(naics), "
+                "typeof(emp), typeof(est) FROM county"
+            ).fetchall(),
+            [("integer", "integer", "text", "integer", "integer")],
+        )
+
+    def test_state_totals_only(self):
+        self.assertEqual(self.load("state"), 1)
+        self.assertEqual(
+            self.db.execute("SELECT * FROM state").fetchall(), [(1, "113310", 300, 30)]
+        )
+
+    def test_zipcode(self):
+        self.assertEqual(self.load("zipcode"), 2)
+        self.assertEqual(
+            self.db.execute("SELECT zip, naics, est FROM zipcode").fetchall(),
+            [(1001, "113310", 3), (99950, "221111", 1)],
+        )
+
+    def test_covering_indexes(self):
+        lookups = {
+            "county": "SELECT naics, est FROM county WHERE fipstate=1 AND fipscty=1",
+            "state": "SELECT naics, est FROM state WHERE fipstate=1",
+            "zipcode": "SELECT naics, est FROM zipcode WHERE zip=1001",
+        }
+        for table, sql in lookups.items():
+            self.load(table)
+            plan = self.db.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            self.assertIn("USING COVERING INDEX", plan[0][3], table)
+
+
+if __name__ == "__main__":
+    unittest.main()
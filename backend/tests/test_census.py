@@ -0,0 +1,89 @@
+import http.server
+import json
+import tempfile
+import threading
+import unittest
+import urllib.parse
+
+import app.cbp.query
+
+
+class StubCensusHandler(http.server.BaseHTTPRequestHandler):
+    # Answers CBP queries with two industries per county; the first request
+    # for each query fails with 503 to exercise the retries.
+    requests = []
+    failed = set()
+
+    def do_GET(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        StubCensusHandler.requests.append(params)
+
+        key = (params["for"][0], params.get("in", [""])[0])
+        if key not in StubCensusHandler.failed:
+            StubCensusHandler.failed.add(key)
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        statefp = params["in"][0].split(":")[1]
+        rows = [["NAICS2017", "EMP", "ESTAB", "state", "county"]]
+        for countyfp in ["001", "003"]:
+            rows.append(["111110", "10", "2", statefp, countyfp])
+            rows.append(["11", "20", "4", statefp, countyfp])
+            rows.append(["111120", "30", "6", statefp, countyfp])
+
+        body = json.dumps(rows).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCensusClient(unittest.TestCase):
+    def setUp(self):
+        StubCensusHandler.requests = []
+        StubCensusHandler.failed = set()
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), StubCensusHandler
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.options = {
+            "session": app.cbp.query.make_session(backoff=0),
+            "base_url": f"http://127.0.0.1:{self.server.server_port}/data/",
+            "api_key": "test",
+            "cache_dir": self.cache_dir.name,
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache_dir.cleanup()
+
+    def test_counties_by_state(self):
+        industries = app.cbp.query.get_all_industries_by_county(
+            statefps=[1, 13], workers=2, **self.options
+        )
+
+        self.assertEqual(len(industries), 8)
+        self.assertEqual(sorted(industries["statefp"].unique()), [1, 13])
+        self.assertEqual(sorted(industries["naics"].unique()), ["111110", "111120"])
+        self.assertEqual(
+            sorted(params["in"][0] for params in StubCensusHandler.requests),
+            ["state:01", "state:01", "state:13", "state:13"],
+        )
+
+        # Served from the disk cache, without another request.
+        cached = app.cbp.query.get_all_industries_by_county(
+            statefps=[1, 13], workers=2, **self.options
+        )
+        self.assertTrue(cached.equals(industries))
+        self.assertEqual(len(StubCensusHandler.requests), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas
+
+import app.generate
+from tests import fixtures
+
+
+class Interrupted(Exception):
+    pass
+
+
+class GenerateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        fixtures.install_matrices(fixtures.make_matrices())
+        fixtures.write_cbp(f"{self.directory.name}/cbp.sqlite3")
+        self.app = fixtures.make_app(self.directory.name)
+        self.database = self.app.config["IMPACTS_DATABASE"]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def generate(self, database=None, **options):
+        fixtures.generate(
+            self.app,
+            "county",
+            fixtures.county_industries(),
+            database=database or self.database,
+            **options,
+        )
+
+    def read(self, database=None):
+        con = sqlite3.connect(database or self.database)
+        try:
+            county = pandas.read_sql(
+                "SELECT * FROM county ORDER BY statefp, countyfp, naics", con
+            )
+            checkpoints = con.execute(
+                "SELECT geography FROM checkpoint WHERE level='county' "
+                "ORDER BY geography"
+            ).fetchall()
+        finally:
+            con.close()
+        return county, [x[0] for x in checkpoints]
+
+
+class TestGenerateLevel(GenerateTestCase):
+    def setUp(self):
+        super().setUp()
+        # Every county computed in a single batch, in this process.
+        self.generate(
+            database=f"{self.directory.name}/expected.sqlite3",
+            workers=1,
+            batch_size=10,
+        )
+        self.expected, self.geographies = self.read(
+            f"{self.directory.name}/expected.sqlite3"
+        )
+
+    def interrupt(self, after):
+        # Stops the run as a kill would, after `after` batches are committed.
+        write_chunk = app.generate.write_chunk
+        calls = []
+
+        def write_then_interrupt(*args):
+            if len(calls) == after:
+                raise Interrupted()
+            calls.append(args)
+            write_chunk(*args)
+
+        return mock.patch.object(app.generate, "write_chunk", write_then_interrupt)
+
+    def test_fixture(self):
+        self.assertEqual(self.geographies, ["1001", "1003", "1005", "2001"])
+        self.assertEqual(self.expected.shape[0], len(fixtures.COUNTIES))
+
+    def test_resume(self):
+        with self.interrupt(after=2), self.assertRaises(Interrupted):
+            self.generate(batch_size=1)
+
+        county, checkpoints = self.read()
+        self.assertEqual(checkpoints, ["1001", "1003"])
+        self.assertEqual(county.shape[0], 4)
+
+        with mock.patch.object(
+            app.generate, "compute_chunk", wraps=app.generate.compute_chunk
+        ) as compute_chunk:
+            self.generate(batch_size=1)
+        # Only the two remaining counties are computed again.
+        self.assertEqual(compute_chunk.call_count, 2)
+
+        county, checkpoints = self.read()
+        self.assertEqual(checkpoints, self.geographies)
+        pandas.testing.assert_frame_equal(county, self.expected)
+
+    def test_rerun(self):
+        self.generate(batch_size=1)
+        self.generate(batch_size=1)
+
+        county, checkpoints = self.read()
+        self.assertEqual(checkpoints, self.geographies)
+        pandas.testing.assert_frame_equal(county, self.expected)
+
+    def test_restart(self):
+        self.generate(batch_size=1)
+        con = sqlite3.connect(self.database)
+        with con:
+            con.execute("UPDATE county SET establishments=0")
+            con.execute("INSERT INTO checkpoint VALUES ('zipcode', '01001')")
+        con.close()
+
+        with self.interrupt(after=1), self.assertRaises(Interrupted):
+            self.generate(batch_size=1, restart=True)
+
+        county, checkpoints = self.read()
+        self.assertEqual(checkpoints, ["1001"])
+        self.assertEqual(county.shape[0], 2)
+        self.assertTrue((county["establishments"] > 0).all())
+
+        con = sqlite3.connect(self.database)
+        other = con.execute("SELECT * FROM checkpoint WHERE level='zipcode'")
+        self.assertEqual(other.fetchall(), [("zipcode", "01001")])
+        con.close()
+
+    def test_workers(self):
+        for workers, batch_size in [(1, 1), (2, 1), (2, 3), (3, 10)]:
+            database = f"{self.directory.name}/{workers}-{batch_size}.sqlite3"
+            self.generate(database=database, workers=workers, batch_size=batch_size)
+
+            county, checkpoints = self.read(database)
+            self.assertEqual(checkpoints, self.geographies)
+            pandas.testing.assert_frame_equal(county, self.expected)
+
+
+class TestBuildIndexes(GenerateTestCase):
+    def test_build_indexes(self):
+        con = app.generate.connect_for_writing(self.database)
+        with self.app.app_context():
+            with mock.patch.dict(
+                app.generate.LEVELS["county"],
+                {"industries": fixtures.county_industries},
+            ):
+                app.generate.compute_level(con, "county", workers=1, batch_size=2)
+        self.assertEqual(con.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+        app.generate.build_indexes(con, "county")
+        con.close()
+
+        con = sqlite3.connect(self.database)
+        indexes = con.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='county'"
+        ).fetchall()
+        self.assertEqual(indexes, [("county_statefp_countyfp",)])
+        stats = con.execute(
+            "SELECT idx FROM sqlite_stat1 WHERE tbl='county'"
+        ).fetchall()
+        self.assertEqual(stats, [("county_statefp_countyfp",)])
+        self.assertEqual(con.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+        con.close()
+        self.assertFalse(os.path.exists(f"{self.database}-wal"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from shapely.geometry import Polygon, box
+
+import app.gis.geocode
+
+
+def make_indexes():
+    zctas = [box(0, 0, 1, 1), box(1, 0, 2, 1)]
+    counties = [Polygon([(0, 0), (2, 0), (0, 1)])]
+    states = [box(0, 0, 2, 1)]
+
+    return {
+        "zcta": app.gis.geocode.build_index(
+            zctas, [{"zipcode": "00001"}, {"zipcode": "00002"}]
+        ),
+        "county": app.gis.geocode.build_index(
+            counties, [{"countyfp": 1, "county_geoid": 1001}]
+        ),
+        "state": app.gis.geocode.build_index(
+            states, [{"statefp": 1, "state_name": "One"}]
+        ),
+    }
+
+
+class TestGeocode(unittest.TestCase):
+    def test_points(self):
+        results = app.gis.geocode.geocode(
+            make_indexes(), [(0.5, 0.25), (1.5, 0.9), (0.5, 0.25), (5, 5)]
+        )
+
+        self.assertEqual(
+            [result["zipcode"] for result in results], ["00001", "00002", "00001", None]
+        )
+        # (1.5, 0.9) lies inside the second zcta's box but not the triangle.
+        self.assertEqual([result["countyfp"] for result in results], [1, None, 1, None])
+        self.assertEqual([result["statefp"] for result in results], [1, 1, 1, None])
+        self.assertEqual((results[3]["lon"], results[3]["lat"]), (5, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
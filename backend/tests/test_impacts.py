@@ -0,0 +1,180 @@
+import unittest
+import numpy
+import pandas
+
+import app.useeio.impacts
+
+
+def make_matrices(seed=0):
+    rng = numpy.random.default_rng(seed)
+    sectors = [f"{x}" for x in range(111000, 111000 + 30 * 7, 7)]
+    impacts = pandas.DataFrame(
+        rng.random((len(sectors), 4)),
+        index=sectors,
+        columns=["Acidification Potential", "Greenhouse Gases", "Energy Use", "Jobs"],
+    )
+
+    rows = []
+    for naics in range(111110, 111110 + 200 * 3, 3):
+        for _ in range(rng.integers(1, 4)):
+            sector = sectors[rng.integers(0, len(sectors))]
+            rows.append(
+                {
+                    "NAICS": str(naics),
+                    "BEA_Sector": sector[:2],
+                    "BEA_Summary": sector[:3],
+                    "BEA_Detail": sector if rng.random() > 0.1 else "unknown",
+                }
+            )
+    crosswalk = pandas.DataFrame(rows)
+
+    return crosswalk, impacts
+
+
+def reference_industry_impacts(industries, crosswalk, impacts):
+    industries = industries.merge(crosswalk, left_on="naics", right_on="NAICS")
+    industries = industries.drop(["NAICS"], axis=1)
+    industries = industries.merge(impacts, left_on="BEA_Detail", right_index=True)
+    grouped = industries.groupby("naics", as_index=False)
+
+    aggregate_default = {x: "first" for x in industries.columns}
+    aggregate_impacts = {x: "mean" for x in impacts.columns}
+    return grouped.agg(aggregate_default | aggregate_impacts)
+
+
+class TestIndustryImpacts(unittest.TestCase):
+    def test_matches_reference(self):
+        crosswalk, impacts = make_matrices()
+        naics_impacts = app.useeio.impacts.build_naics_impacts(
+            crosswalk=crosswalk, impacts=impacts
+        )
+
+        rng = numpy.random.default_rng(1)
+        naics = [str(x) for x in rng.integers(111100, 111800, 120)]
+        industries = pandas.DataFrame(
+            {
+                "naics": naics + ["------", "11----", "999999"],
+                "establishments": rng.integers(1, 100, len(naics) + 3),
+            }
+        ).drop_duplicates("naics")
+        industries = industries.astype({"establishments": "int32"})
+
+        pandas.testing.assert_frame_equal(
+            app.useeio.impacts.gather_industry_impacts(industries, naics_impacts),
+            reference_industry_impacts(industries, crosswalk, impacts),
+            check_dtype=False,
+        )
+
+    def test_no_matches(self):
+        crosswalk, impacts = make_matrices()
+        naics_impacts = app.useeio.impacts.build_naics_impacts(
+            crosswalk=crosswalk, impacts=impacts
+        )
+        industries = pandas.DataFrame({"naics": ["------"], "establishments": [1]})
+
+        result = app.useeio.impacts.gather_industry_impacts(industries, naics_impacts)
+
+        self.assertEqual(result.shape[0], 0)
+
+    def test_footprint_totals(self):
+        crosswalk, impacts = make_matrices()
+        naics_impacts = app.useeio.impacts.build_naics_impacts(
+            crosswalk=crosswalk, impacts=impacts
+        )
+
+        rng = numpy.random.default_rng(4)
+        industries = pandas.DataFrame(
+            {
+                "naics": [str(x) for x in rng.integers(111100, 111800, 120)],
+                "establishments": rng.integers(1, 100, 120),
+                "EMP": rng.integers(0, 1000, 120),
+            }
+        )
+
+        totals = app.useeio.impacts.footprint_totals(
+            industries, naics_impacts, weights=["establishments", "EMP"]
+        )
+
+        rows = app.useeio.impacts.gather_industry_impacts(industries, naics_impacts)
+        rows = rows.merge(industries.drop_duplicates("naics")[["naics", "EMP"]])
+        for i, weight in enumerate(["establishments", "EMP"]):
+            expected = rows[impacts.columns].multiply(rows[weight], axis=0).sum()
+            numpy.testing.assert_allclose(totals[i], expected.to_numpy())
+
+
+class TestGeographyImpacts(unittest.TestCase):
+    def test_matches_per_geography(self):
+        crosswalk, impacts = make_matrices()
+        naics_impacts = app.useeio.impacts.build_naics_impacts(
+            crosswalk=crosswalk, impacts=impacts
+        )
+
+        rng = numpy.random.default_rng(2)
+        industries = pandas.DataFrame(
+            {
+                "statefp": rng.integers(1, 4, 600),
+                "countyfp": rng.integers(1, 6, 600),
+                "naics": [str(x) for x in rng.integers(111100, 111800, 600)],
+                "establishments": rng.integers(1, 100, 600),
+            }
+        )
+
+        matrix = app.useeio.impacts.build_establishment_matrix(
+            industries, naics_impacts, keys=["statefp", "countyfp"]
+        )
+        result = app.useeio.impacts.gather_geography_impacts(matrix, naics_impacts)
+
+        for (statefp, countyfp), group in industries.groupby(["statefp", "countyfp"]):
+            expected = app.useeio.impacts.gather_industry_impacts(group, naics_impacts)
+            actual = result[
+                (result["statefp"] == statefp) & (result["countyfp"] == countyfp)
+            ]
+            pandas.testing.assert_frame_equal(
+                actual.drop(["statefp", "countyfp"], axis=1).reset_index(drop=True),
+                expected,
+            )
+
+    def test_state_rollup(self):
+        crosswalk, impacts = make_matrices()
+        naics_impacts = app.useeio.impacts.build_naics_impacts(
+            crosswalk=crosswalk, impacts=impacts
+        )
+
+        rng = numpy.random.default_rng(3)
+        industries = pandas.DataFrame(
+            {
+                "statefp": rng.integers(1, 4, 600),
+                "countyfp": rng.integers(1, 6, 600),
+                "naics": [str(x) for x in rng.integers(111100, 111800, 600)],
+                "establishments": rng.integers(1, 100, 600),
+            }
+        )
+        matrix = app.useeio.impacts.build_establishment_matrix(
+            industries, naics_impacts, keys=["statefp", "countyfp"]
+        )
+        counties = app.useeio.impacts.gather_geography_impacts(matrix, naics_impacts)
+
+        result = app.useeio.impacts.rollup_impacts(
+            counties.drop(["countyfp"], axis=1), keys=["statefp"]
+        )
+
+        expected = counties.groupby(["statefp", "naics"])["establishments"].sum()
+        self.assertEqual(len(result), len(expected))
+        self.assertTrue(
+            (result.set_index(["statefp", "naics"])["establishments"] == expected).all()
+        )
+        # Every county row of an industry carries the same impacts, so the
+        # weighted average reproduces them.
+        for statefp, group in result.groupby("statefp"):
+            state_industries = counties[counties["statefp"] == statefp]
+            state_industries = state_industries.drop_duplicates("naics")
+            expected = app.useeio.impacts.gather_industry_impacts(
+                state_industries, naics_impacts
+            )
+            pandas.testing.assert_frame_equal(
+                group.drop(["statefp", "establishments"], axis=1).reset_index(
+                    drop=True
+                ),
+                expected.drop(["establishments"], axis=1),
+                check_exact=False,
+            )
@@ -0,0 +1,102 @@
+import mmap
+import os
+import tempfile
+import unittest
+import numpy
+import pandas
+
+import app.useeio.matrices
+
+
+def write_workbook(filepath, A=None):
+    D = pandas.DataFrame(
+        [[1.5, 2.5, 3.5], [4.5, 5.5, 6.5]],
+        index=pandas.Index(["Greenhouse Gases", "Energy Use"], name="Indicator"),
+        columns=["111110/US", "111120/US", "111130/US"],
+    )
+    crosswalk = pandas.DataFrame(
+        {
+            "NAICS": ["111110", "111120", "111130"],
+            "BEA_Detail": ["111110", "111120", "111130"],
+        }
+    )
+    indicators = pandas.DataFrame(
+        {"Name": ["Greenhouse Gases", "Energy Use"], "Code": ["GHG", "ENRG"]}
+    ).set_index("Name")
+
+    with pandas.ExcelWriter(filepath) as writer:
+        D.to_excel(writer, sheet_name="D")
+        crosswalk.to_excel(writer, sheet_name="SectorCrosswalk", index=False)
+        indicators.to_excel(writer, sheet_name="indicators")
+        if A is not None:
+            A.to_excel(writer, sheet_name="A")
+
+
+def is_memory_mapped(array):
+    while array is not None:
+        if isinstance(array, (numpy.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+class TestCompiledMatrices(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "USEEIOv2.0.xlsx")
+        self.target = os.path.join(self.directory.name, "USEEIOv2.0.compiled")
+        write_workbook(self.source)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_missing_artifact(self):
+        self.assertIsNone(
+            app.useeio.matrices.load_compiled(target=self.target, source=self.source)
+        )
+
+    def test_roundtrip(self):
+        expected = app.useeio.matrices.load_workbook(self.source)
+        app.useeio.matrices.compile_matrices(source=self.source, target=self.target)
+        compiled = app.useeio.matrices.load_compiled(
+            target=self.target, source=self.source
+        )
+
+        self.assertTrue(is_memory_mapped(compiled["D"].to_numpy()))
+        for name in ["D", "SectorCrosswalk", "indicators"]:
+            pandas.testing.assert_frame_equal(compiled[name], expected[name])
+
+    def test_stale_artifact(self):
+        app.useeio.matrices.compile_matrices(source=self.source, target=self.target)
+        stat = os.stat(self.source)
+        os.utime(self.source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        self.assertIsNone(
+            app.useeio.matrices.load_compiled(target=self.target, source=self.source)
+        )
+
+
+class TestTotalRequirements(unittest.TestCase):
+    def test_derived_from_A(self):
+        sectors = ["111110/US", "111120/US", "111130/US"]
+        A = pandas.DataFrame(
+            [[0.1, 0.2, 0.0], [0.0, 0.1, 0.3], [0.2, 0.0, 0.1]],
+            index=sectors,
+            columns=sectors,
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "USEEIOv2.0.xlsx")
+            target = os.path.join(directory, "USEEIOv2.0.compiled")
+            write_workbook(source, A=A)
+            app.useeio.matrices.compile_matrices(source=source, target=target)
+            compiled = app.useeio.matrices.load_compiled(target=target, source=source)
+
+            L = compiled["L"].to_numpy()
+            numpy.testing.assert_allclose(
+                (numpy.identity(3) - A.to_numpy()) @ L, numpy.identity(3), atol=1e-12
+            )
+            numpy.testing.assert_allclose(
+                compiled["N"].to_numpy(), compiled["D"].to_numpy() @ L
+            )
+            self.assertTrue(is_memory_mapped(compiled["N"].to_numpy()))
@@ -0,0 +1,201 @@
+import json
+import sqlite3
+import unittest
+
+import app.gis.query
+
+
+def make_db(count):
+    # `count` unit-square ZCTAs in a row along the x axis, each indexed in the
+    # R*Tree as SpatiaLite's CreateSpatialIndex would, with GeoJSON geometries.
+    db = sqlite3.connect(":memory:")
+    db.row_factory = sqlite3.Row
+    db.execute("CREATE TABLE zcta_shp (ZCTA5CE20 TEXT)")
+    db.execute(
+        "CREATE VIRTUAL TABLE idx_zcta_shp_geometry USING rtree(pkid, xmin, xmax, ymin, ymax)"
+    )
+    db.execute("CREATE TABLE zcta_geojson (ZCTA5CE20 TEXT, geometry TEXT)")
+
+    for i in range(count):
+        zipcode = f"{i:05d}"
+        ring = [[i, 0], [i + 1, 0], [i + 1, 1], [i, 1], [i, 0]]
+        geometry = json.dumps({"type": "Polygon", "coordinates": [ring]})
+        rowid = db.execute("INSERT INTO zcta_shp VALUES (?)", (zipcode,)).lastrowid
+        db.execute(
+            "INSERT INTO idx_zcta_shp_geometry VALUES (?, ?, ?, 0, 1)",
+            (rowid, i, i + 1),
+        )
+        db.execute("INSERT INTO zcta_geojson VALUES (?, ?)", (zipcode, geometry))
+
+    return db
+
+
+def read(chunks):
+    return json.loads("".join(chunks))
+
+
+class TestStreamIntersectingMbr(unittest.TestCase):
+    def setUp(self):
+        self.db = make_db(10)
+        # Covers the squares from x=2.5 to x=7.5: ZCTAs 00002 to 00007.
+        self.mbr = {"x1": 2.5, "y1": 0.5, "x2": 7.5, "y2": 0.6}
+
+    def tearDown(self):
+        self.db.close()
+
+    def stream(self, **options):
+        options = {"mbr": self.mbr, "limit": 10, "centroid_limit": 10, **options}
+        return read(
+            app.gis.query.stream_intersecting_mbr("zcta", db=self.db, **options)
+        )
+
+    def zipcodes(self, collection):
+        return [x["properties"]["zipcode"] for x in collection["features"]]
+
+    def test_geometries(self):
+        collection = self.stream()
+
+        self.assertEqual(self.zipcodes(collection), [f"{i:05d}" for i in range(2, 8)])
+        self.assertEqual(collection["features"][0]["geometry"]["type"], "Polygon")
+        self.assertNotIn("centroids", collection)
+
+    def test_cursor_pages(self):
+        pages = []
+        cursor = 0
+        while cursor is not None:
+            page = self.stream(limit=4, cursor=cursor)
+            pages.append(self.zipcodes(page))
+            cursor = page["next"]
+
+        self.assertEqual(
+            pages,
+            [["00002", "00003", "00004", "00005"], ["00006", "00007"]],
+        )
+
+    def test_last_full_page(self):
+        first = self.stream(limit=3, cursor=0)
+        second = self.stream(limit=3, cursor=first["next"])
+        third = self.stream(limit=3, cursor=second["next"])
+
+        self.assertEqual(len(second["features"]), 3)
+        self.assertIsNotNone(second["next"])
+        self.assertEqual(third["features"], [])
+        self.assertIsNone(third["next"])
+
+    def test_centroids(self):
+        collection = self.stream(limit=5, centroid_limit=4)
+
+        self.assertTrue(collection["centroids"])
+        self.assertEqual(
+            self.zipcodes(collection), ["00002", "00003", "00004", "00005"]
+        )
+        self.assertEqual(
+            collection["features"][0]["geometry"],
+            {"type": "Point", "coordinates": [2.5, 0.5]},
+        )
+
+        rest = self.stream(
+            limit=5, centroid_limit=4, cursor=collection["next"], centroids=True
+        )
+        self.assertTrue(rest["centroids"])
+        self.assertEqual(self.zipcodes(rest), ["00006", "00007"])
+        self.assertIsNone(rest["next"])
+
+    def test_known(self):
+        collection = self.stream(known=["00003", "00005"])
+
+        self.assertEqual(
+            self.zipcodes(collection), ["00002", "00004", "00006", "00007"]
+        )
+
+    def test_previous(self):
+        # The client panned right from a frame over ZCTAs 00000 to 00004.
+        previous = {"x1": 0.5, "y1": 0.5, "x2": 4.5, "y2": 0.6}
+        collection = self.stream(previous=previous)
+
+        self.assertEqual(self.zipcodes(collection), ["00005", "00006", "00007"])
+
+    def test_previous_and_known(self):
+        previous = {"x1": 0.5, "y1": 0.5, "x2": 4.5, "y2": 0.6}
+        collection = self.stream(previous=previous, known=["00006"])
+
+        self.assertEqual(self.zipcodes(collection), ["00005", "00007"])
+
+    def test_previous_centroids(self):
+        # The previous frame, over ZCTAs 00000 to 00005, held more than the
+        # limit and was answered with centroids, so nothing is left out.
+        previous = {"x1": 0.5, "y1": 0.5, "x2": 5.5, "y2": 0.6}
+        self.assertTrue(self.stream(limit=5, mbr=previous)["centroids"])
+
+        mbr = {"x1": 3.5, "y1": 0.5, "x2": 7.5, "y2": 0.6}
+        collection = self.stream(limit=5, mbr=mbr, previous=previous)
+
+        self.assertNotIn("centroids", collection)
+        self.assertEqual(self.zipcodes(collection), [f"{i:05d}" for i in range(3, 8)])
+
+
+class TestResolutions(unittest.TestCase):
+    def setUp(self):
+        self.db = make_db(3)
+        self.mbr = {"x1": 0.5, "y1": 0.5, "x2": 2.5, "y2": 0.6}
+
+    def tearDown(self):
+        self.db.close()
+
+    def add_simplified(self, table):
+        # Simplified to the center point of each square.
+        self.db.execute(
+            f"CREATE TABLE {table} AS SELECT ZCTA5CE20, json_object('type', "
+            "'Point', 'coordinates', json_array(CAST(ZCTA5CE20 AS INTEGER) + 0.5, "
+            "0.5)) AS geometry FROM zcta_geojson"
+        )
+
+    def geometry_types(self, zoom):
+        chunks = app.gis.query.stream_intersecting_mbr(
+            "zcta", db=self.db, mbr=self.mbr, limit=10, centroid_limit=10, zoom=zoom
+        )
+        return {x["geometry"]["type"] for x in read(chunks)["features"]}
+
+    def test_zoom(self):
+        tables = [
+            app.gis.query.get_geojson_table("zcta", zoom)
+            for zoom in [None, 14, 10, 9, 7, 6, 0]
+        ]
+
+        self.assertEqual(
+            tables,
+            [
+                "zcta_geojson",
+                "zcta_geojson",
+                "zcta_geojson",
+                "zcta_geojson_3",
+                "zcta_geojson_3",
+                "zcta_geojson_1",
+                "zcta_geojson_1",
+            ],
+        )
+
+    def test_missing_tables(self):
+        self.assertEqual(
+            app.gis.query.get_geojson_table("zcta", 3, db=self.db), "zcta_geojson"
+        )
+        self.assertEqual(self.geometry_types(3), {"Polygon"})
+
+    def test_missing_table(self):
+        self.add_simplified("zcta_geojson_1")
+
+        self.assertEqual(
+            app.gis.query.get_geojson_table("zcta", 3, db=self.db), "zcta_geojson_1"
+        )
+        # Zoom 8 is served from zcta_geojson_3, missing here, and falls back
+        # to the more detailed table rather than the less detailed one.
+        self.assertEqual(
+            app.gis.query.get_geojson_table("zcta", 8, db=self.db), "zcta_geojson"
+        )
+        self.assertEqual(self.geometry_types(3), {"Point"})
+        self.assertEqual(self.geometry_types(8), {"Polygon"})
+        self.assertEqual(self.geometry_types(None), {"Polygon"})
+
+
+if __name__ == "__main__":
+    unittest.main()
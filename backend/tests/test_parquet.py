@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas
+import pyarrow
+import pyarrow.parquet
+
+import app.operations
+import app.parquet
+from tests import fixtures
+
+
+class TestParquet(unittest.TestCase):
+    # The county and zipcode impacts generated from the fixture CBP rows,
+    # exported to a parquet dataset.
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        fixtures.install_matrices(fixtures.make_matrices())
+        self.app = fixtures.make_app(self.directory.name)
+        fixtures.generate(self.app, "county", fixtures.county_industries())
+        fixtures.generate(self.app, "zipcode", fixtures.zipcode_industries())
+
+        self.db = sqlite3.connect(self.app.config["IMPACTS_DATABASE"])
+        self.root = self.app.config["IMPACTS_PARQUET"]
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def export(self, level):
+        return list(app.parquet.export_dataset(db=self.db, level=level, root=self.root))
+
+    def read(self, level, **filters):
+        # The dataset's rows, read as the app does, in the impacts table's
+        # column order and dtypes.
+        with self.app.app_context():
+            df = app.operations.read_direct_industry_impacts(level, **filters)
+        table = pandas.read_sql(f'SELECT * FROM "{level}" LIMIT 0', self.db)
+        df = df[table.columns]
+        for column in table.columns:
+            if str(df[column].dtype) == "category":
+                df[column] = df[column].astype(int)
+        return df.reset_index(drop=True)
+
+    def expected(self, sql, **params):
+        return pandas.read_sql(sql, self.db, params=params)
+
+    def row_groups(self, level, partition):
+        # The geographies in each row group of one partition's file.
+        keys = app.parquet.LAYOUTS[level]["keys"]
+        path = os.path.join(self.root, level, partition, "part-0.parquet")
+        parquet = pyarrow.parquet.ParquetFile(path)
+        groups = []
+        for i in range(parquet.num_row_groups):
+            rows = parquet.read_row_group(i).to_pandas()
+            groups.append(
+                sorted(
+                    set(rows[[x for x in keys if x in rows]].itertuples(index=False))
+                )
+            )
+        return groups
+
+    def test_round_trip(self):
+        self.assertEqual(self.export("county"), [(1, 5), (2, 1)])
+        self.assertEqual(self.export("zipcode"), [("0", 4)])
+
+        pandas.testing.assert_frame_equal(
+            self.read("county"),
+            self.expected("SELECT * FROM county ORDER BY statefp, countyfp, naics"),
+            check_dtype=False,
+        )
+        pandas.testing.assert_frame_equal(
+            self.read("zipcode"),
+            self.expected("SELECT * FROM zipcode ORDER BY zipcode, naics"),
+            check_dtype=False,
+        )
+
+    def test_filters(self):
+        self.export("county")
+        self.export("zipcode")
+
+        pandas.testing.assert_frame_equal(
+            self.read("county", statefp=1, countyfp=3),
+            self.expected(
+                "SELECT * FROM county WHERE statefp=1 AND countyfp=3 ORDER BY naics"
+            ),
+            check_dtype=False,
+        )
+        pandas.testing.assert_frame_equal(
+            self.read("zipcode", zipcode="01002"),
+            self.expected("SELECT * FROM zipcode WHERE zipcode='01002' ORDER BY naics"),
+            check_dtype=False,
+        )
+
+    def test_partition_pruning(self):
+        self.export("county")
+        # Reading state 1 never opens state 2's file.
+        with open(os.path.join(self.root, "county/statefp=2/part-0.parquet"), "w") as f:
+            f.write("not parquet")
+
+        df = self.read("county", statefp=1)
+
+        self.assertEqual(df.shape[0], 5)
+        self.assertEqual(set(df["statefp"]), {1})
+        with self.assertRaises(pyarrow.ArrowInvalid):
+            self.read("county", statefp=2)
+
+    def test_row_groups(self):
+        self.export("county")
+        self.assertEqual(
+            self.row_groups("county", "statefp=1"), [[(1,)], [(3,)], [(5,)]]
+        )
+
+        # Geographies are buffered until a group holds at least three rows,
+        # so the two zipcodes of two rows each share one group.
+        with mock.patch.dict(app.parquet.LAYOUTS["zipcode"], {"row_group_rows": 3}):
+            self.export("zipcode")
+        self.assertEqual(
+            self.row_groups("zipcode", "zipcode_prefix=0"), [[("01001",), ("01002",)]]
+        )
+
+        with mock.patch.dict(app.parquet.LAYOUTS["zipcode"], {"row_group_rows": 1}):
+            self.export("zipcode")
+        self.assertEqual(
+            self.row_groups("zipcode", "zipcode_prefix=0"), [[("01001",)], [("01002",)]]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+import app.operations
+import app.payloads
+from tests import fixtures
+
+STATES = [{"statefp": 1, "name": "Alabama"}, {"statefp": 2, "name": "Alaska"}]
+BODY = json.dumps(STATES).encode()
+ETAG = hashlib.sha1(BODY).hexdigest()
+
+
+class PayloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = fixtures.make_app(self.directory.name)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, *encodings):
+        # The payload as `flask generate payloads` writes it, in `encodings`.
+        payload = app.payloads.compress(BODY)
+        payload = {x: payload[x] for x in ["etag", "identity", *encodings]}
+        app.payloads.write_payload(self.app.config["INDEX_PAYLOADS"], "states", payload)
+
+    def get(self, **headers):
+        return self.client.get("/query/state/all", headers=headers)
+
+
+class TestEncodings(PayloadTestCase):
+    @unittest.skipIf(app.payloads.brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        self.write("br", "gzip")
+        response = self.get(**{"Accept-Encoding": "gzip, br"})
+
+        self.assertEqual(response.content_encoding, "br")
+        self.assertEqual(app.payloads.brotli.decompress(response.data), BODY)
+        self.assertEqual(response.get_etag(), (f"{ETAG}-br", False))
+
+    def test_gzip(self):
+        self.write("br", "gzip")
+        response = self.get(**{"Accept-Encoding": "gzip"})
+
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertEqual(gzip.decompress(response.data), BODY)
+        self.assertEqual(response.get_etag(), (f"{ETAG}-gzip", False))
+        self.assertIn("Accept-Encoding", response.vary)
+
+    def test_without_brotli_file(self):
+        self.write("gzip")
+        response = self.get(**{"Accept-Encoding": "br, gzip"})
+
+        self.assertEqual(response.content_encoding, "gzip")
+
+    def test_identity(self):
+        self.write("br", "gzip")
+        for headers in [{}, {"Accept-Encoding": "identity"}]:
+            response = self.get(**headers)
+
+            self.assertIsNone(response.content_encoding)
+            self.assertEqual(response.json, STATES)
+            self.assertEqual(response.get_etag(), (f"{ETAG}-identity", False))
+
+    def test_built_once(self):
+        # Without generated payloads the index is built on first request.
+        with mock.patch.object(
+            app.operations, "get_index", return_value=STATES
+        ) as get_index:
+            first = self.get(**{"Accept-Encoding": "gzip"})
+            second = self.get()
+
+        get_index.assert_called_once_with("states")
+        self.assertEqual(json.loads(gzip.decompress(first.data)), STATES)
+        self.assertEqual(second.json, STATES)
+
+
+class TestNotModified(PayloadTestCase):
+    def test_matching_etag(self):
+        self.write("gzip")
+        response = self.get(
+            **{"Accept-Encoding": "gzip", "If-None-Match": f'"{ETAG}-gzip"'}
+        )
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.get_etag(), (f"{ETAG}-gzip", False))
+
+    def test_other_encoding(self):
+        # A cached gzip response does not match a client without gzip.
+        self.write("gzip")
+        response = self.get(**{"If-None-Match": f'"{ETAG}-gzip"'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, STATES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import app.pool
+from app.db import get_cbp_db, get_pool
+from tests import fixtures
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+        self.pool = app.pool.ConnectionPool(self.connect, max_idle=1)
+
+    def connect(self):
+        connection = mock.Mock()
+        self.opened.append(connection)
+        return connection
+
+    def test_reuse(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        second = self.pool.acquire()
+
+        self.assertIs(first, second)
+        self.assertEqual(
+            self.pool.stats(), {"idle": 0, "in_use": 1, "opened": 1, "reused": 1}
+        )
+
+    def test_max_idle(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.pool.release(first)
+        self.pool.release(second)
+
+        self.assertEqual(self.pool.stats()["idle"], 1)
+        second.close.assert_called_once()
+        first.close.assert_not_called()
+
+    def test_close(self):
+        idle = self.pool.acquire()
+        in_use = self.pool.acquire()
+        self.pool.release(idle)
+        self.pool.close()
+
+        idle.close.assert_called_once()
+        in_use.close.assert_not_called()
+        self.pool.release(in_use)
+        in_use.close.assert_called_once()
+
+    def test_fork(self):
+        self.pool.release(self.pool.acquire())
+
+        with mock.patch.object(app.pool.os, "getpid", return_value=os.getpid() + 1):
+            self.assertEqual(
+                self.pool.stats(), {"idle": 0, "in_use": 0, "opened": 0, "reused": 0}
+            )
+            connection = self.pool.acquire()
+
+        # The connection inherited from the parent is neither reused nor closed.
+        self.assertIsNot(connection, self.opened[0])
+        self.opened[0].close.assert_not_called()
+        self.assertEqual(len(self.opened), 2)
+
+
+class TestPoolRotation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = f"{self.directory.name}/cbp.sqlite3"
+        fixtures.write_cbp(self.filepath)
+        self.app = fixtures.make_app(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def count(self):
+        with self.app.app_context():
+            db = get_cbp_db()
+            return db.execute("SELECT count(*) FROM zipcode").fetchone()[0], db
+
+    def test_reused_until_replaced(self):
+        rows, first = self.count()
+        _, second = self.count()
+        with self.app.app_context():
+            pool = get_pool("CBP_DATABASE")
+
+        self.assertEqual(rows, len(fixtures.ZIPCODES))
+        self.assertIs(first, second)
+        self.assertEqual(pool.stats()["reused"], 1)
+
+        # Regenerated elsewhere and moved into place, as a new inode.
+        replacement = f"{self.directory.name}/new.sqlite3"
+        fixtures.write_cbp(replacement)
+        con = sqlite3.connect(replacement)
+        with con:
+            con.execute("DELETE FROM zipcode WHERE zip=1001")
+        con.close()
+        os.replace(replacement, self.filepath)
+
+        rows, third = self.count()
+
+        self.assertEqual(rows, 2)
+        self.assertIsNot(third, first)
+        self.assertTrue(pool.closed)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            first.execute("SELECT 1")
+        with self.app.app_context():
+            self.assertIsNot(get_pool("CBP_DATABASE"), pool)
+
+
+if __name__ == "__main__":
+    unittest.main()
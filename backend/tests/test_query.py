@@ -1,6 +1,373 @@
+import json
+import numpy
+import os
+import pandas
+import sqlite3
+import tempfile
 import unittest
+from unittest import mock
+
+import app.generate
+import app.operations
+import app.query
+from tests import fixtures
 
 
 class TestTesting(unittest.TestCase):
     def test_testing(self):
         self.assertEqual(True, True)
+
+
+class QueryTestCase(unittest.TestCase):
+    # An app over a small CBP database, with the county and zipcode impacts
+    # generated from it.
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        fixtures.install_matrices(fixtures.make_matrices())
+        fixtures.write_cbp(f"{self.directory.name}/cbp.sqlite3")
+        self.app = fixtures.make_app(self.directory.name)
+        fixtures.generate(self.app, "county", fixtures.county_industries())
+        fixtures.generate(self.app, "zipcode", fixtures.zipcode_industries())
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class TestPercentiles(QueryTestCase):
+    def test_county(self):
+        response = self.client.get("/query/county/percentiles?statefp=1&countyfp=3")
+
+        self.assertEqual(response.status_code, 200)
+        percentiles = {x["indicator"]: x for x in response.json["percentiles"]}
+        # 1/3: 1 * 1.5 + 8 * 3.5 is the largest GHG total of the four counties.
+        self.assertEqual(percentiles["GHG"]["total"], 29.5)
+        self.assertEqual(percentiles["GHG"]["percentile"], 100.0)
+        self.assertEqual(percentiles["GHG"]["count"], 4)
+
+    def test_unknown_geography(self):
+        response = self.client.get("/query/county/percentiles?statefp=9&countyfp=9")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("No impacts found", response.json["message"])
+
+    def test_missing_distribution(self):
+        con = sqlite3.connect(self.app.config["IMPACTS_DATABASE"])
+        with con:
+            con.execute("DELETE FROM distribution WHERE level='zipcode'")
+        con.close()
+
+        response = self.client.get("/query/zipcode/percentiles?zipcode=01001")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("flask generate distributions", response.json["message"])
+
+    def test_missing_tables(self):
+        con = sqlite3.connect(self.app.config["IMPACTS_DATABASE"])
+        with con:
+            con.execute("DROP TABLE county_totals")
+        con.close()
+
+        response = self.client.get("/query/county/percentiles?statefp=1&countyfp=3")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("flask generate distributions", response.json["message"])
+
+    def test_other_errors(self):
+        # Only a missing distribution is reported as such.
+        with mock.patch.object(
+            app.operations, "get_indicator_columns", side_effect=KeyError("GHG")
+        ):
+            with self.assertRaises(KeyError):
+                self.client.get("/query/county/percentiles?statefp=1&countyfp=3")
+
+    def test_invalid_request(self):
+        response = self.client.get("/query/county/percentiles?statefp=1")
+
+        self.assertEqual(response.status_code, 400)
+
+
+class TestTopIndustries(QueryTestCase):
+    def test_rank_order(self):
+        response = self.client.get(
+            "/query/county/top?statefp=1&countyfp=1&indicator=GHG"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        industries = response.json["industries"]
+        # 4 establishments at 2.5 contribute more than 2 at 1.5.
+        self.assertEqual([x["naics"] for x in industries], ["111120", "111110"])
+        self.assertEqual([x["rank"] for x in industries], [1, 2])
+
+    def test_limit(self):
+        response = self.client.get(
+            "/query/zipcode/top?zipcode=01002&indicator=ENRG&limit=1"
+        )
+        self.assertEqual([x["naics"] for x in response.json["industries"]], ["111130"])
+
+        for limit in ["0", "51", "1.5"]:
+            response = self.client.get(
+                f"/query/zipcode/top?zipcode=01002&indicator=ENRG&limit={limit}"
+            )
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_unknown_indicator(self):
+        response = self.client.get(
+            "/query/county/top?statefp=1&countyfp=1&indicator=XYZ"
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_depth(self):
+        runner = self.app.test_cli_runner()
+        database = self.app.config["IMPACTS_DATABASE"]
+        result = runner.invoke(
+            args=["generate", "rankings", "--database", database, "--depth", "1"]
+        )
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Ranked county by 2 indicators into 8 rows", result.output)
+        con = sqlite3.connect(database)
+        rows = con.execute(
+            "SELECT statefp, countyfp, indicator, max(rank), count(*) "
+            "FROM county_rank GROUP BY statefp, countyfp, indicator"
+        ).fetchall()
+        con.close()
+        self.assertEqual(len(rows), 8)
+        self.assertTrue(all(row[3:] == (1, 1) for row in rows))
+
+        # A shallower ranking serves fewer industries than the limit.
+        response = self.client.get(
+            "/query/county/top?statefp=1&countyfp=1&indicator=GHG&limit=2"
+        )
+        self.assertEqual([x["naics"] for x in response.json["industries"]], ["111120"])
+
+        result = runner.invoke(
+            args=["generate", "rankings", "--database", database, "--depth", "51"]
+        )
+        self.assertNotEqual(result.exit_code, 0)
+
+
+class TestRegionImpacts(QueryTestCase):
+    def test_counties(self):
+        response = self.client.post(
+            "/query/region/impacts", json={"level": "county", "ids": [1001, 1003]}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        industries = {x["naics"]: x for x in response.json["industries"]}
+        self.assertEqual(
+            {naics: x["establishments"] for naics, x in industries.items()},
+            {"111110": 3, "111120": 4, "111130": 8},
+        )
+        self.assertEqual(industries["111130"]["Greenhouse Gases"], 3.5)
+
+    def test_zipcodes(self):
+        response = self.client.post(
+            "/query/region/impacts",
+            json={"level": "zipcode", "ids": ["01001", "01002"]},
+        )
+
+        industries = response.json["industries"]
+        self.assertEqual(
+            {x["naics"]: x["establishments"] for x in industries},
+            {"111110": 5, "111120": 1, "111130": 6},
+        )
+
+    def test_id_order(self):
+        first = self.client.post(
+            "/query/region/impacts", json={"level": "county", "ids": [1001, 1003, 1005]}
+        )
+        second = self.client.post(
+            "/query/region/impacts",
+            json={"level": "county", "ids": [1005, 1001, 1003, 1001]},
+        )
+
+        self.assertEqual(first.get_etag(), second.get_etag())
+        self.assertEqual(first.data, second.data)
+        stats = self.app.extensions["impacts_cache"].stats()
+        self.assertEqual((stats["entries"], stats["hits"]), (1, 1))
+
+    def test_ids_or_polygon(self):
+        response = self.client.post("/query/region/impacts", json={"level": "county"})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class TestImpactsCache(QueryTestCase):
+    url = "/query/county/impacts?statefp=1&countyfp=3"
+
+    def get(self, **headers):
+        with mock.patch.object(
+            app.operations,
+            "get_direct_industry_impacts_by_county",
+            wraps=app.operations.get_direct_industry_impacts_by_county,
+        ) as compute:
+            response = self.client.get(self.url, headers=headers)
+        return response, compute.call_count
+
+    def test_cached(self):
+        first, computed = self.get()
+        self.assertEqual((first.status_code, computed), (200, 1))
+
+        second, computed = self.get()
+        self.assertEqual((second.status_code, computed), (200, 0))
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.get_etag(), first.get_etag())
+
+    def test_not_modified(self):
+        etag, _ = self.get()[0].get_etag()
+        cache = self.app.extensions["impacts_cache"]
+        cache.clear()
+        misses = cache.stats()["misses"]
+
+        response, computed = self.get(**{"If-None-Match": f'"{etag}"'})
+
+        self.assertEqual((response.status_code, computed), (304, 0))
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.get_etag(), (etag, False))
+        self.assertEqual(cache.stats()["misses"], misses)
+
+        response, computed = self.get(**{"If-None-Match": '"other"'})
+        self.assertEqual((response.status_code, computed), (200, 1))
+
+    def test_format_etag(self):
+        records = self.client.get(self.url)
+        split = self.client.get(self.url + "&format=split")
+
+        self.assertNotEqual(records.get_etag(), split.get_etag())
+
+    def test_regenerated(self):
+        first, _ = self.get()
+        stat = os.stat(self.app.config["IMPACTS_DATABASE"])
+        os.utime(
+            self.app.config["IMPACTS_DATABASE"],
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 1),
+        )
+
+        second, computed = self.get(**{"If-None-Match": first.headers["ETag"]})
+
+        self.assertEqual((second.status_code, computed), (200, 1))
+        self.assertNotEqual(second.get_etag(), first.get_etag())
+        self.assertEqual(second.data, first.data)
+
+
+class TestResponseFormat(QueryTestCase):
+    def records(self, body):
+        industries = json.loads(body)["industries"]
+        if isinstance(industries, list):
+            return industries
+        return [dict(zip(industries["columns"], x)) for x in industries["data"]]
+
+    def test_full_precision(self):
+        values = [1 / 3, 0.1 + 0.2, 1.2345678901234567e-7, 1e-20, 123456.78901234567]
+        industries = pandas.DataFrame(
+            {
+                "naics": ["111110", "111120", "111130", 'say "111140"', "111150"],
+                "establishments": [1, 2, 3, 4, 2**40],
+                "value": values,
+            }
+        )
+
+        for response_format in ["records", "split"]:
+            body = app.query.serialize_industries(industries, response_format)
+            self.assertEqual(
+                self.records(body), industries.to_dict("records"), response_format
+            )
+
+    def test_split_edge_cases(self):
+        industries = pandas.DataFrame(
+            {"naics": ["111110", None], "value": [numpy.nan, numpy.inf]}
+        )
+        body = app.query.serialize_industries(industries, "split")
+        self.assertEqual(
+            json.loads(body),
+            {
+                "industries": {
+                    "columns": ["naics", "value"],
+                    "data": [["111110", None], [None, None]],
+                }
+            },
+        )
+
+        body = app.query.serialize_industries(industries.head(0), "split")
+        self.assertEqual(json.loads(body)["industries"]["data"], [])
+
+    def test_formats_equal(self):
+        url = "/query/state/impacts?statefp=1&breakdown=county"
+        records = self.client.get(url)
+        split = self.client.get(url, headers={"Accept": app.query.SPLIT_MIMETYPE})
+
+        self.assertIn("statefp", split.json["industries"]["columns"])
+        self.assertEqual(self.records(split.data), self.records(records.data))
+
+
+class TestFootprint(QueryTestCase):
+    def test_county(self):
+        response = self.client.get("/query/county/footprint?statefp=1&countyfp=3")
+
+        self.assertEqual(response.status_code, 200)
+        footprint = response.json["footprint"]
+        self.assertEqual(footprint["establishments"]["GHG"], 1 * 1.5 + 8 * 3.5)
+        self.assertEqual(footprint["employment"]["GHG"], 30 * 1.5 + 40 * 3.5)
+
+    def test_zipcode_has_no_employment(self):
+        response = self.client.post(
+            "/query/zipcode/footprint", json={"zipcode": "01002"}
+        )
+
+        self.assertEqual(
+            response.json["footprint"], {"establishments": {"GHG": 25.5, "ENRG": 52.5}}
+        )
+
+    def test_unknown_geography(self):
+        for url in [
+            "/query/zipcode/footprint?zipcode=99999",
+            "/query/county/footprint?statefp=9&countyfp=9",
+            "/query/state/footprint?statefp=9",
+        ]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404, url)
+
+
+class TestTotalFootprint(QueryTestCase):
+    def test_total_scope(self):
+        A = pandas.DataFrame(
+            [[0.1, 0.2, 0.0], [0.0, 0.1, 0.3], [0.2, 0.0, 0.1]],
+            index=fixtures.SECTORS,
+            columns=fixtures.SECTORS,
+        )
+        matrices = fixtures.make_matrices(A=A)
+        fixtures.install_matrices(matrices)
+
+        response = self.client.get(
+            "/query/county/footprint?statefp=1&countyfp=3&scope=total"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        # 1/3 has one 111110 and eight 111130 establishments.
+        N = matrices["N"].to_numpy()
+        expected = N @ numpy.array([1, 0, 8])
+        footprint = response.json["footprint"]["establishments"]
+        numpy.testing.assert_allclose([footprint["GHG"], footprint["ENRG"]], expected)
+        # Supply-chain impacts add to the direct ones.
+        self.assertTrue((expected > [29.5, 56.5]).all())
+
+    def test_total_scope_without_requirements(self):
+        response = self.client.get(
+            "/query/county/footprint?statefp=1&countyfp=3&scope=total"
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("no total impacts", response.json["message"])
+
+    def test_unknown_scope(self):
+        response = self.client.get(
+            "/query/county/footprint?statefp=1&countyfp=3&scope=indirect"
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
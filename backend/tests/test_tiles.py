@@ -0,0 +1,93 @@
+import gzip
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import mapbox_vector_tile
+
+import app.gis.tiles
+from app.db import get_tiles_db
+from tests import fixtures
+from tests.test_mbr import make_db
+
+
+class TestTilesDb(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = fixtures.make_app(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_created_once(self):
+        with mock.patch.object(
+            app.gis.tiles, "create_mbtiles", wraps=app.gis.tiles.create_mbtiles
+        ) as create_mbtiles:
+            with self.app.app_context():
+                first = get_tiles_db("county")
+                app.gis.tiles.write_cached_tile(first, 3, 1, 2, b"tile")
+            with self.app.app_context():
+                second = get_tiles_db("county")
+                data = app.gis.tiles.get_tile(
+                    db=None, mbtiles=second, layer="county", z=3, x=1, y=2
+                )
+
+        self.assertEqual(create_mbtiles.call_count, 1)
+        self.assertIs(first, second)
+        self.assertEqual(data, b"tile")
+
+        con = sqlite3.connect(f"{self.directory.name}/tiles/county.mbtiles")
+        self.assertEqual(con.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(
+            dict(con.execute("SELECT name, value FROM metadata")),
+            {"name": "county", "format": "pbf", "minzoom": "3", "maxzoom": "14"},
+        )
+        self.assertEqual(
+            con.execute(
+                "SELECT zoom_level, tile_column, tile_row FROM tiles"
+            ).fetchall(),
+            [(3, 1, 5)],
+        )
+        con.close()
+
+
+class TestRenderTile(unittest.TestCase):
+    def setUp(self):
+        # Unit-square ZCTAs from longitude 0 to 10, latitude 0 to 1.
+        self.db = make_db(10)
+
+    def tearDown(self):
+        self.db.close()
+
+    def render(self, x, y):
+        data = app.gis.tiles.render_tile(db=self.db, layer="zcta", z=7, x=x, y=y)
+        return mapbox_vector_tile.decode(gzip.decompress(data))
+
+    def test_features(self):
+        # Tile 7/64/63 spans longitudes 0 to 2.8125 above the equator.
+        tile = self.render(64, 63)
+
+        self.assertEqual(list(tile), ["zcta"])
+        self.assertEqual(tile["zcta"]["extent"], app.gis.tiles.EXTENT)
+        features = tile["zcta"]["features"]
+        self.assertEqual(
+            [feature["properties"] for feature in features],
+            [{"zipcode": "00000"}, {"zipcode": "00001"}, {"zipcode": "00002"}],
+        )
+        for feature in features:
+            self.assertEqual(feature["geometry"]["type"], "Polygon")
+            # Clipped to the tile and its buffer.
+            for x, y in feature["geometry"]["coordinates"][0]:
+                self.assertLessEqual(x, app.gis.tiles.EXTENT + app.gis.tiles.BUFFER)
+                self.assertGreaterEqual(x, -app.gis.tiles.BUFFER)
+
+    def test_empty(self):
+        # Tile 7/70/63 starts at longitude 16.875, past every ZCTA.
+        tile = self.render(70, 63)
+
+        self.assertEqual(tile.get("zcta", {}).get("features", []), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,37 +1,81 @@
+import importlib.util
 import os
-import pandas
 import sqlite3
-from typing import cast
+import pandas
+
+CHUNK_SIZE = 100_000
+
+# The table layout is shared with the backend's `flask generate cbp`. Its
+# module is loaded from the file, as this package is also named `app` and
+# the loader should not need Flask.
+spec = importlib.util.spec_from_file_location(
+    "cbp_database",
+    os.path.join(os.path.dirname(__file__), "../../../app/cbp/database.py"),
+)
+database = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(database)
 
+# The downloaded CBP files loaded into each table. Files are streamed in
+# chunks, keeping only detailed (6-digit) NAICS rows and the table's columns,
+# typed as in database.SCHEMA.
+FILES = {
+    "county": {"filename": "cbp19co.txt", "encoding": "UTF-8"},
+    # State rows are broken down by legal form of organization; "-" is the
+    # total over all of them.
+    "state": {"filename": "cbp19st.txt", "encoding": "UTF-8", "lfo": "-"},
+    "zipcode": {"filename": "zbp19detail.txt", "encoding": "ISO-8859-1"},
+}
 
-def load_raw_csv(filename, encoding="UTF-8") -> pandas.DataFrame:
-    result = pandas.read_csv(os.path.join("raw", filename), encoding=encoding)
-    return cast(pandas.DataFrame, result)
+DTYPES = {"INTEGER": "int64", "TEXT": "str"}
 
 
-def county(db):
-    df: pandas.DataFrame = load_raw_csv("cbp19co.txt")
-    df.to_sql("county", db, if_exists="replace", index=False)
+def read_chunks(table, *, raw, chunksize=CHUNK_SIZE):
+    config = FILES[table]
+    schema = database.SCHEMA[table]["columns"]
+    columns = list(schema)
+    usecols = columns + (["lfo"] if "lfo" in config else [])
 
+    chunks = pandas.read_csv(
+        os.path.join(raw, config["filename"]),
+        encoding=config["encoding"],
+        usecols=lambda name: name.lower() in usecols,
+        dtype=str,
+        chunksize=chunksize,
+    )
 
-def state(db):
-    df: pandas.DataFrame = load_raw_csv("cbp19st.txt")
-    df.to_sql("state", db, if_exists="replace", index=False)
+    for chunk in chunks:
+        chunk.columns = chunk.columns.str.lower()
+        chunk = chunk[chunk["naics"].str.fullmatch(r"\d{6}")]
+        if "lfo" in config:
+            chunk = chunk[chunk["lfo"] == config["lfo"]]
 
+        yield chunk[columns].astype(
+            {name: DTYPES[kind] for name, kind in schema.items()}
+        )
 
-def zipcode(db):
-    df: pandas.DataFrame = load_raw_csv("zbp19detail.txt", encoding="ISO-8859-1")
-    df.to_sql("zipcode", db, if_exists="replace", index=False)
+
+def load(db, table, *, raw, chunksize=CHUNK_SIZE) -> int:
+    rows = 0
+    with db:
+        database.create_table(db, table)
+        for chunk in read_chunks(table, raw=raw, chunksize=chunksize):
+            database.insert_rows(db, table, chunk.itertuples(index=False, name=None))
+            rows += len(chunk)
+        database.create_index(db, table)
+
+    return rows
 
 
 if __name__ == "__main__":
     db = sqlite3.connect(os.path.join("out", "db.sqlite3"))
-    print("Loading counties...")
-    county(db)
-    print("Loading States...")
-    state(db)
-    print("Loading Zipcodes...")
-    zipcode(db)
+    db.execute("PRAGMA journal_mode=OFF")
+    db.execute("PRAGMA synchronous=OFF")
+
+    for table in FILES:
+        print(f"Loading {table}...")
+        print(f"Loaded {load(db, table, raw='raw')} rows.")
+
+    db.execute("ANALYZE")
     print("Done.")
 
     db.close()